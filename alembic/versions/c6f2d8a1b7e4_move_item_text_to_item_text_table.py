@@ -0,0 +1,78 @@
+"""Move item name and description to item_text, deduplicated by content hash
+
+Revision ID: c6f2d8a1b7e4
+Revises: a7c41e9b3d52
+Create Date: 2026-10-17 16:41:09.207513
+
+"""
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6f2d8a1b7e4'
+down_revision = 'a7c41e9b3d52'
+branch_labels = None
+depends_on = None
+
+
+def _get_item_text_hash(name, description):
+    # Same as utils.db_utils.get_item_text_hash when this revision was written
+    normalized_text = [" ".join(text.split()) if text else text for text in (name, description)]
+    return hashlib.sha256(json.dumps(normalized_text).encode("utf-8")).hexdigest()
+
+
+def upgrade() -> None:
+    op.create_table('item_text',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content_hash', sa.String(), nullable=True),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('content_hash')
+    )
+    with op.batch_alter_table('item') as batch_op:
+        batch_op.add_column(sa.Column('item_text_id', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_item_item_text_id', ['item_text_id'], unique=False)
+        batch_op.create_foreign_key('fk_item_item_text_id', 'item_text', ['item_text_id'], ['id'])
+
+    # Every distinct name and description becomes one item_text row
+    connection = op.get_bind()
+    item_texts = {}
+    item_hashes = []
+    for item_id, name, description in connection.execute(sa.text('SELECT id, name, description FROM item')):
+        content_hash = _get_item_text_hash(name, description)
+        item_texts.setdefault(content_hash, {'content_hash': content_hash, 'name': name, 'description': description})
+        item_hashes.append({'item_id': item_id, 'content_hash': content_hash})
+    if item_texts:
+        connection.execute(
+            sa.text('INSERT INTO item_text (content_hash, name, description) VALUES (:content_hash, :name, :description)'),
+            list(item_texts.values()),
+        )
+        connection.execute(
+            sa.text('UPDATE item SET item_text_id = (SELECT id FROM item_text WHERE content_hash = :content_hash) WHERE id = :item_id'),
+            item_hashes,
+        )
+
+    with op.batch_alter_table('item') as batch_op:
+        batch_op.drop_column('description')
+        batch_op.drop_column('name')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('item') as batch_op:
+        batch_op.add_column(sa.Column('name', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('description', sa.String(), nullable=True))
+    op.execute(
+        'UPDATE item SET '
+        'name = (SELECT name FROM item_text WHERE item_text.id = item.item_text_id), '
+        'description = (SELECT description FROM item_text WHERE item_text.id = item.item_text_id)'
+    )
+    with op.batch_alter_table('item') as batch_op:
+        batch_op.drop_constraint('fk_item_item_text_id', type_='foreignkey')
+        batch_op.drop_index('ix_item_item_text_id')
+        batch_op.drop_column('item_text_id')
+    op.drop_table('item_text')
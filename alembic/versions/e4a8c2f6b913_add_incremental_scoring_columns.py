@@ -0,0 +1,31 @@
+"""Track which items and restaurants were scored from their current text and menu
+
+Revision ID: e4a8c2f6b913
+Revises: c6f2d8a1b7e4
+Create Date: 2026-10-17 19:12:45.803164
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a8c2f6b913'
+down_revision = 'c6f2d8a1b7e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Left NULL, so every item and restaurant is scored again by the next run
+    op.add_column('item', sa.Column('scored_item_text_id', sa.Integer(), nullable=True))
+    op.create_index('ix_item_unscored', 'item', ['id'], unique=False, sqlite_where=sa.text('scored_item_text_id IS NOT item_text_id'))
+    op.add_column('restaurant', sa.Column('scored_fingerprint', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('restaurant') as batch_op:
+        batch_op.drop_column('scored_fingerprint')
+    op.drop_index('ix_item_unscored', table_name='item')
+    with op.batch_alter_table('item') as batch_op:
+        batch_op.drop_column('scored_item_text_id')
@@ -0,0 +1,67 @@
+"""Store restaurant rel_url as the store path only and merge duplicate restaurants
+
+Revision ID: f3b9d5e1a7c8
+Revises: e4a8c2f6b913
+Create Date: 2026-10-17 21:04:37.518290
+
+"""
+from urllib.parse import urlsplit
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b9d5e1a7c8'
+down_revision = 'e4a8c2f6b913'
+branch_labels = None
+depends_on = None
+
+
+def _get_store_rel_url(href):
+    # Same as flows.restaurant_stable._get_store_rel_url when this revision was written
+    return urlsplit(href.strip()).path.rstrip('/') or '/'
+
+
+def upgrade() -> None:
+    # rel_url used to be the whole href, with a query that differs between the
+    # categories listing a store, so a store could be stored once per category. The
+    # most recently crawled row of a store is kept and gets the items of the others.
+    # Its menu and score are marked as changed, so the next crawl saves its menu again
+    # and drops items that aren't on it, then the next scoring run rescores it.
+    # Run it between crawls, a pending frontier can still hold the ids of merged rows
+    connection = op.get_bind()
+    stores = {}
+    for restaurant_id, rel_url, last_crawled_at in connection.execute(
+        sa.text('SELECT id, rel_url, last_crawled_at FROM restaurant WHERE rel_url IS NOT NULL')
+    ):
+        stores.setdefault(_get_store_rel_url(rel_url), []).append((last_crawled_at or '', -restaurant_id, rel_url))
+
+    merged = []
+    renamed = []
+    for store_rel_url, rows in stores.items():
+        rows.sort(reverse=True)
+        kept_id = -rows[0][1]
+        merged.extend({'kept_id': kept_id, 'merged_id': -merged_id} for _, merged_id, _ in rows[1:])
+        if len(rows) > 1 or rows[0][2] != store_rel_url:
+            renamed.append({'kept_id': kept_id, 'rel_url': store_rel_url, 'merged': len(rows) > 1})
+
+    if merged:
+        connection.execute(sa.text('UPDATE item SET restaurant_id = :kept_id WHERE restaurant_id = :merged_id'), merged)
+        connection.execute(sa.text('DELETE FROM restaurant WHERE id = :merged_id'), merged)
+    if renamed:
+        connection.execute(
+            sa.text(
+                'UPDATE restaurant SET rel_url = :rel_url, '
+                'content_fingerprint = CASE WHEN :merged THEN NULL ELSE content_fingerprint END, '
+                'scored_fingerprint = CASE WHEN :merged THEN NULL ELSE scored_fingerprint END '
+                'WHERE id = :kept_id'
+            ),
+            renamed,
+        )
+
+
+def downgrade() -> None:
+    # The query of the original hrefs and the merged rows are gone, both rel_urls
+    # work with the previous revision
+    pass
@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from typing import List
+
+import fire
+from sqlalchemy import select
+
+# The DB url and profile are read from the environment when utils.db_utils is
+# imported, so every run happens in fresh spawned processes
+from utils.db_utils import (
+    Category,
+    CategoryInfo,
+    ReadOnlySession,
+    Restaurant,
+    RestaurantInfo,
+    create_db_tables,
+    get_categories_from_db,
+    save_categories_to_db,
+    save_restaurants_to_db,
+)
+
+
+def _setup() -> None:
+    create_db_tables()
+    save_categories_to_db([CategoryInfo("Benchmark", "/category/benchmark")])
+
+
+def _write(writer: int, num_batches: int, batch_size: int) -> None:
+    # Each batch is one transaction, like a task saving one category page
+    category = get_categories_from_db()[0]
+    for batch in range(num_batches):
+        save_restaurants_to_db(
+            category,
+            [
+                RestaurantInfo(
+                    f"Restaurant {writer}-{batch}-{i}",
+                    4.5,
+                    f"/store/{writer}-{batch}-{i}",
+                )
+                for i in range(batch_size)
+            ],
+        )
+
+
+def _read(done, latencies_ms) -> None:
+    # A restaurant and its category looked up by url, so the latency is mostly time
+    # spent waiting on locks rather than scanning the growing table
+    query = (
+        select(Restaurant.name, Restaurant.rating, Category.name)
+        .join(Category, Restaurant.category_id == Category.id)
+        .where(Restaurant.rel_url == "/store/0-0-0")
+    )
+    latencies = []
+    while not done.is_set():
+        start = time.perf_counter()
+        with ReadOnlySession() as session:
+            session.execute(query).all()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies_ms.extend(latencies)
+
+
+def _run_profile(
+    profile: str, writers: int, num_batches: int, batch_size: int
+) -> List[str]:
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["FOODREC_DB_URL"] = f"sqlite:///{tmp_dir}/menu.db?timeout=60"
+        os.environ["FOODREC_DB_PROFILE"] = profile
+        setup = context.Process(target=_setup)
+        setup.start()
+        setup.join()
+
+        manager = context.Manager()
+        done, latencies_ms = manager.Event(), manager.list()
+        reader = context.Process(target=_read, args=(done, latencies_ms))
+        reader.start()
+        write_processes = [
+            context.Process(target=_write, args=(writer, num_batches, batch_size))
+            for writer in range(writers)
+        ]
+        start = time.perf_counter()
+        for process in write_processes:
+            process.start()
+        for process in write_processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        reader.join()
+
+        latencies = sorted(latencies_ms)
+        manager.shutdown()
+    rows = writers * num_batches * batch_size
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else float("nan")
+    return [
+        profile,
+        f"{rows / elapsed:.0f}",
+        f"{writers * num_batches / elapsed:.1f}",
+        f"{len(latencies)}",
+        f"{statistics.median(latencies) if latencies else float('nan'):.2f}",
+        f"{p99:.2f}",
+        f"{latencies[-1] if latencies else float('nan'):.2f}",
+    ]
+
+
+def main(
+    profiles: str = "defaults,wal",
+    writers: int = 8,
+    num_batches: int = 50,
+    batch_size: int = 200,
+) -> None:
+    # Concurrent writer processes save restaurant batches while a reader process keeps
+    # querying, per storage profile on a fresh DB
+    header = ["profile", "rows/s", "txn/s", "reads", "p50 ms", "p99 ms", "max ms"]
+    rows = [
+        _run_profile(profile, writers, num_batches, batch_size)
+        for profile in profiles.split(",")
+    ]
+    print("".join(f"{column:>12}" for column in header))
+    for row in rows:
+        print("".join(f"{value:>12}" for value in row))
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import List
+
+import fire
+from sqlalchemy import event
+
+# The DB url is read from the environment when utils.db_utils is imported, so the
+# writer runs in a fresh spawned process
+from utils.db_utils import (
+    DB_ENGINE,
+    CategoryInfo,
+    DbTable,
+    DbWriter,
+    RestaurantInfo,
+    create_db_tables,
+    get_categories_from_db,
+    save_categories_to_db,
+)
+
+
+def _flush(num_writes: int, batch_size: int, results) -> None:
+    create_db_tables()
+    save_categories_to_db([CategoryInfo("Benchmark", "/category/benchmark")])
+    category = get_categories_from_db()[0]
+    # Every statement SQLite runs, from a fresh connection that traces them
+    statements: List[str] = []
+    event.listen(
+        DB_ENGINE,
+        "connect",
+        lambda dbapi_connection, connection_record: dbapi_connection.set_trace_callback(
+            statements.append
+        ),
+    )
+    DB_ENGINE.dispose()
+
+    # Only the flush below writes, however many records are pending
+    writer = DbWriter(max_pending=num_writes * batch_size + 1, flush_interval_secs=3600)
+    for write in range(num_writes):
+        writer.write(
+            DbTable.RESTAURANT,
+            [
+                RestaurantInfo(f"Restaurant {write}-{i}", 4.5, f"/store/{write}-{i}")
+                for i in range(batch_size)
+            ],
+            category.id,
+        )
+    start = time.perf_counter()
+    writer.flush()
+    results.extend(
+        [
+            time.perf_counter() - start,
+            sum(statement.strip().upper() == "COMMIT" for statement in statements),
+        ]
+    )
+
+
+def main(num_writes: int = 200, batch_size: int = 50) -> None:
+    # Flushes num_writes pending writes of batch_size restaurants and counts the
+    # transactions SQLite committed, which must be exactly one per flush
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["FOODREC_DB_URL"] = f"sqlite:///{tmp_dir}/menu.db?timeout=60"
+        manager = context.Manager()
+        results = manager.list()
+        process = context.Process(target=_flush, args=(num_writes, batch_size, results))
+        process.start()
+        process.join()
+        flush_secs, commits = list(results)
+        manager.shutdown()
+    rows = num_writes * batch_size
+    print(
+        f"Flushed {num_writes} writes ({rows} rows) in {flush_secs:.2f}s, "
+        f"{rows / flush_secs:.0f} rows/s, {commits} commits"
+    )
+    if commits != 1:
+        raise RuntimeError(f"A flush committed {commits} transactions instead of 1")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,112 @@
+import os
+import tempfile
+import time
+
+from typing import List, NamedTuple
+
+import fire
+
+from utils.frontier import CrawlFrontier, CrawlStage, FrontierEntry, drain_stage
+from utils.utils import CRAWL_FRONTIER_MAX_ATTEMPTS
+
+
+class _State(NamedTuple):
+    completed: bool
+    message: str = ""
+
+    def is_completed(self) -> bool:
+        return self.completed
+
+
+class _Future(NamedTuple):
+    # Stands in for the prefect future of a task that ran on entries
+    state: _State
+
+    def wait(self) -> _State:
+        return self.state
+
+    def result(self) -> None:
+        return None
+
+
+def _run_failing(path: str, seeds: List[FrontierEntry], failing_url: str) -> int:
+    # A flow run whose task fails every time on the batch with failing_url, returns
+    # what is left pending for the next run
+    frontier = CrawlFrontier(path)
+    frontier.put(seeds)
+    drain_stage(
+        frontier,
+        CrawlStage.CITY,
+        lambda entries: _Future(
+            _State(all(entry.url != failing_url for entry in entries), "timed out")
+        ),
+        1,
+    )
+    pending = frontier.pending(CrawlStage.CITY)
+    if not pending:
+        frontier.clear()
+    return pending
+
+
+def main(num_entries: int = 10000, batch_size: int = 200) -> None:
+    # Queues num_entries store pages, pulls and acks them in batches and checks how
+    # many the frontier reports pending along the way, the flows only clear a
+    # frontier with nothing pending
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "frontier")
+        frontier = CrawlFrontier(path)
+        entries = [
+            FrontierEntry(CrawlStage.STORE, f"https://example.com/store/{i}", i)
+            for i in range(num_entries)
+        ]
+        start = time.perf_counter()
+        frontier.put(entries)
+        put_secs = time.perf_counter() - start
+        checks = [(frontier.pending(CrawlStage.STORE), num_entries, "put")]
+
+        start = time.perf_counter()
+        pulled = frontier.pull(CrawlStage.STORE, batch_size)
+        checks.append((frontier.pending(CrawlStage.STORE), num_entries, "pulled"))
+        frontier.ack(pulled)
+        checks.append(
+            (frontier.pending(CrawlStage.STORE), num_entries - batch_size, "acked")
+        )
+        # An interrupted run, its pulled entries are put back when reopened
+        frontier.pull(CrawlStage.STORE, batch_size)
+        frontier = CrawlFrontier(path)
+        checks.append(
+            (frontier.pending(CrawlStage.STORE), num_entries - batch_size, "resumed")
+        )
+        pulled = frontier.pull(CrawlStage.STORE, batch_size)
+        while pulled:
+            frontier.ack(pulled)
+            pulled = frontier.pull(CrawlStage.STORE, batch_size)
+        drain_secs = time.perf_counter() - start
+        checks.append((frontier.pending(CrawlStage.STORE), 0, "drained"))
+
+        # A page that fails every run is retried by the next runs, then given up on
+        # so the frontier is cleared and the seeds are crawled again
+        seeds = [
+            FrontierEntry(CrawlStage.CITY, f"https://example.com/city/{i}")
+            for i in range(3)
+        ]
+        failing_path = os.path.join(tmp_dir, "failing")
+        for run in range(CRAWL_FRONTIER_MAX_ATTEMPTS):
+            expected = int(run + 1 < CRAWL_FRONTIER_MAX_ATTEMPTS)
+            pending = _run_failing(failing_path, seeds, seeds[0].url)
+            checks.append((pending, expected, f"failing run {run + 1}"))
+        checks.append(
+            (_run_failing(failing_path, seeds, ""), 0, "a run after giving up")
+        )
+
+    print(
+        f"Put {num_entries} entries in {put_secs:.2f}s, pulled and acked them in "
+        f"batches of {batch_size} in {drain_secs:.2f}s"
+    )
+    for pending, expected, step in checks:
+        if pending != expected:
+            raise RuntimeError(f"{pending} entries pending once {step}, not {expected}")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,145 @@
+import random
+from typing import List, Optional
+
+import fire
+from bs4 import BeautifulSoup
+
+from benchmarks.pages import load_archived_pages, measure, print_measurements
+from utils.db_utils import RestaurantInfo
+from utils.extraction import extract_links, extract_restaurant_cards
+
+
+def _get_rating_from_restaurant_box(restaurant_box: BeautifulSoup) -> int:
+    for child in restaurant_box.findChildren("div", recursive=True):
+        try:
+            rating = float(child.text)
+            return rating
+        except Exception:
+            continue
+    return 0
+
+
+def _bs4_extract_restaurant_cards(page_text: str) -> List[RestaurantInfo]:
+    # The category page parsing get_restaurants_in_category used before
+    # utils/extraction.py
+    page_info = BeautifulSoup(page_text, features="html.parser")
+    restaurants = []
+    for header in page_info.find_all("h3"):
+        if header.parent is None or header.parent.get("href") is None:
+            continue
+        rel_restaurant_url = header.parent.get("href")
+        if rel_restaurant_url.startswith("/store"):
+            restaurant_name = header.get_text()
+            rating = _get_rating_from_restaurant_box(header.parent.parent)
+            restaurants.append(
+                RestaurantInfo(restaurant_name, rating, rel_restaurant_url)
+            )
+    return restaurants
+
+
+def _bs4_extract_links(page_text: str, href_prefix: str) -> List[str]:
+    # The search page parsing get_allrecipes_urls used before utils/extraction.py
+    soup = BeautifulSoup(page_text, "html.parser")
+    main_element = soup.find("main")
+    return [
+        a_element["href"]
+        for a_element in main_element.find_all("a", href=True)
+        if a_element["href"].startswith(href_prefix)
+    ]
+
+
+def make_synthetic_category_page(num_restaurants: int = 300) -> str:
+    # Roughly the shape of an UberEats category page: a grid of nested store cards,
+    # each with the name in an h3 inside the store link and the rating further down
+    cards = []
+    for i in range(num_restaurants):
+        rating = random.choice(["4.5", "4.7", "4.8", "New"])
+        # Some pages are pretty-printed, the rating is then indented on its own line
+        if random.random() < 0.3:
+            rating = f"\n{' ' * 40}{rating}\n{' ' * 36}"
+        cards.append(
+            '<div class="card"><div><picture><img src="https://img/x.jpeg"/></picture>'
+            '<button aria-label="Save">♡</button></div>'
+            f'<a href="/store/restaurant-{i}/abc{i}?diningMode=DELIVERY">'
+            f"<h3>Restaurant {i} &amp; Grill</h3></a>"
+            "<div><div><div><span>$0.99 Delivery Fee</span></div>"
+            "<div><span>•</span></div><div><span>20–30 min</span></div></div>"
+            f'<div class="rating"><div>{rating}</div></div></div>'
+            + "".join(f"<div><div><span>promo {j}</span></div></div>" for j in range(5))
+            + "</div>"
+        )
+    return (
+        "<html><body><header><a href='/category/emeryville-ca/thai'>Thai</a></header>"
+        '<main><div class="grid">' + "".join(cards) + "</div></main></body></html>"
+    )
+
+
+def make_synthetic_search_page(num_links: int = 300) -> str:
+    links = "".join(
+        f'<div class="card"><a href="https://www.allrecipes.com/recipes/{i}/veg/">'
+        f"<div><img src='https://img/{i}.jpg'/></div><span>Recipe {i}</span></a>"
+        f"<div><span>{random.randint(1, 900)} Ratings</span></div></div>"
+        for i in range(num_links)
+    )
+    return (
+        "<html><head><script>var x = 1;</script></head><body><nav>"
+        '<a href="https://www.allrecipes.com/recipes/nav/">nav</a></nav>'
+        f"<main>{links}</main></body></html>"
+    )
+
+
+def main(archive: Optional[str] = None, limit: int = 200, synthetic_pages: int = 20):
+    if archive:
+        category_pages = load_archived_pages(archive, "/category/", limit)
+        search_pages = load_archived_pages(archive, "allrecipes.com/search", limit)
+    else:
+        random.seed(0)
+        category_pages = [
+            make_synthetic_category_page() for _ in range(synthetic_pages)
+        ]
+        search_pages = [make_synthetic_search_page() for _ in range(synthetic_pages)]
+
+    measurements = []
+    if category_pages:
+        mismatches = sum(
+            _bs4_extract_restaurant_cards(page) != extract_restaurant_cards(page)
+            for page in category_pages
+        )
+        print(f"{mismatches} category pages where the extractors disagree")
+        measurements.append(
+            measure(
+                "bs4 restaurant cards", _bs4_extract_restaurant_cards, category_pages
+            )
+        )
+        measurements.append(
+            measure(
+                "extract_restaurant_cards", extract_restaurant_cards, category_pages
+            )
+        )
+    if search_pages:
+        href_prefix = "https://www.allrecipes.com/recipes/"
+        mismatches = sum(
+            _bs4_extract_links(page, href_prefix)
+            != [link["href"] for link in extract_links(page, href_prefix, "main")]
+            for page in search_pages
+        )
+        print(f"{mismatches} search pages where the extractors disagree")
+        measurements.append(
+            measure(
+                "bs4 links",
+                lambda page: _bs4_extract_links(page, href_prefix),
+                search_pages,
+            )
+        )
+        measurements.append(
+            measure(
+                "extract_links",
+                lambda page: extract_links(page, href_prefix, "main"),
+                search_pages,
+            )
+        )
+    print_measurements(measurements)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
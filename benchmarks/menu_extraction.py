@@ -0,0 +1,114 @@
+import json
+import random
+from typing import List, Optional
+
+import fire
+from bs4 import BeautifulSoup
+
+from benchmarks.pages import load_archived_pages, measure, print_measurements
+from utils.db_utils import ItemInfo
+from utils.extraction import extract_menu_items
+
+
+def _bs4_extract_menu_items(page_text: str, restaurant_id: int) -> List[ItemInfo]:
+    # The store page parsing get_items_in_restaurant used before utils/extraction.py
+    page_info = BeautifulSoup(page_text, features="html.parser")
+    matches = page_info.find_all("script", type="application/ld+json")
+    all_item_infos = []
+    for match in matches:
+        match = json.loads(match.text)
+        if match.get("@type") == "Restaurant":
+            menu = match.get("hasMenu")
+            if menu:
+                menu_selection = menu.get("hasMenuSection")
+                if menu_selection:
+                    for menu in menu_selection:
+                        menu_items = menu.get("hasMenuItem")
+                        if menu_items:
+                            for item in menu_items:
+                                name, description = item.get("name"), item.get(
+                                    "description"
+                                )
+                                dummy_rel_url = f"{name}+{restaurant_id}"
+                                item_info = ItemInfo(name, description, dummy_rel_url)
+                                all_item_infos.append(item_info)
+            break
+    return all_item_infos
+
+
+def make_synthetic_store_page(
+    num_sections: int = 15, items_per_section: int = 20
+) -> str:
+    # Roughly the shape of an UberEats store page: a big DOM of menu cards plus the
+    # ld+json Restaurant block with the same menu
+    sections = []
+    cards = []
+    for s in range(num_sections):
+        items = []
+        for i in range(items_per_section):
+            name = (
+                f"Dish {s}-{i} {random.choice(['Tofu', 'Paneer', 'Chicken', 'Veggie'])}"
+            )
+            description = " ".join(
+                random.choice(["spicy", "rice", "beans", "garlic", "fresh", "sauce"])
+                for _ in range(20)
+            )
+            items.append(
+                {"@type": "MenuItem", "name": name, "description": description}
+            )
+            cards.append(
+                '<li><div class="c1"><div class="c2"><a href="/store/x?mod=quickView">'
+                f"<div><span>{name}</span></div><div><span>{description}</span></div>"
+                '<div><span>$12.99</span></div></a><button aria-label="Add">+</button>'
+                f'</div><picture><img src="https://img/{s}/{i}.jpeg"/></picture></div></li>'
+            )
+        sections.append(
+            {"@type": "MenuSection", "name": f"Section {s}", "hasMenuItem": items}
+        )
+    restaurant = {
+        "@context": "https://schema.org",
+        "@type": "Restaurant",
+        "name": "Synthetic Restaurant",
+        "hasMenu": {"@type": "Menu", "hasMenuSection": sections},
+    }
+    return (
+        '<html><head><script>window.__REDUX_STATE__ = "{}";</script>'
+        '<script type="application/ld+json">'
+        + json.dumps(restaurant)
+        + '</script></head><body><div id="main-content"><ul>'
+        + "".join(cards)
+        + "</ul></div></body></html>"
+    )
+
+
+def main(
+    archive: Optional[str] = None,
+    limit: int = 200,
+    synthetic_pages: int = 50,
+) -> None:
+    if archive:
+        pages = load_archived_pages(archive, "/store/", limit)
+    else:
+        random.seed(0)
+        pages = [make_synthetic_store_page() for _ in range(synthetic_pages)]
+    if not pages:
+        print("No store pages to benchmark")
+        return
+    print(f"Average page size {sum(map(len, pages)) / len(pages) / 1024:.0f} KiB")
+
+    mismatches = sum(
+        _bs4_extract_menu_items(page, 0) != extract_menu_items(page, 0)
+        for page in pages
+    )
+    print(f"{mismatches} pages where the extractors disagree")
+
+    print_measurements(
+        [
+            measure("bs4 html.parser", lambda p: _bs4_extract_menu_items(p, 0), pages),
+            measure("extract_menu_items", lambda p: extract_menu_items(p, 0), pages),
+        ]
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,45 @@
+import gc
+import time
+import tracemalloc
+from typing import Callable, List, NamedTuple
+
+from utils.replay import ResponseArchive
+
+
+class Measurement(NamedTuple):
+    name: str
+    pages: int
+    ms_per_page: float
+    peak_kib: float
+
+
+def load_archived_pages(archive_path: str, url_pattern: str, limit: int) -> List[str]:
+    # Pages recorded with `python main.py <flow> --http_mode=record`
+    archive = ResponseArchive(archive_path)
+    return [archive.replay(url)[1] for url in archive.find_urls(url_pattern, limit)]
+
+
+def measure(
+    name: str, parse_page: Callable[[str], object], pages: List[str]
+) -> Measurement:
+    # Time is measured without tracemalloc since tracing slows allocations down a lot,
+    # the peak is then the largest single page parse
+    gc.collect()
+    start = time.perf_counter()
+    for page in pages:
+        parse_page(page)
+    ms_per_page = (time.perf_counter() - start) * 1000 / len(pages)
+
+    peak_bytes = 0
+    for page in pages:
+        tracemalloc.start()
+        parse_page(page)
+        peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return Measurement(name, len(pages), ms_per_page, peak_bytes / 1024)
+
+
+def print_measurements(measurements: List[Measurement]) -> None:
+    print(f"{'parser':<28}{'pages':>8}{'ms/page':>12}{'peak KiB':>12}")
+    for m in measurements:
+        print(f"{m.name:<28}{m.pages:>8}{m.ms_per_page:>12.2f}{m.peak_kib:>12.0f}")
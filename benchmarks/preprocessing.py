@@ -0,0 +1,110 @@
+import random
+import re
+import time
+from typing import Callable, List, Optional
+
+import fire
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+
+from scoring.preprocess import (
+    _lemmatize,
+    ensure_nltk_data,
+    preprocess,
+    preprocess_batch,
+)
+from utils.utils import PREPROCESS_PROCESSES
+
+_FOOD_WORDS = (
+    "chicken beef pork tofu tempeh shrimp salmon egg cheese mushroom potato tomato "
+    "onion garlic pepper spinach kale rice noodle bean lentil chickpea avocado corn "
+    "carrot cabbage eggplant zucchini basil cilantro ginger lime lemon coconut curry "
+    "sauce soup salad burger taco burrito bowl wrap roll sandwich pizza pasta dumpling "
+    "fried grilled roasted spicy crispy steamed sweet sour fresh house special"
+).split()
+_FILLER_WORDS = "with and in on of served topped the a our your choice side".split()
+
+
+def _notebook_preprocess(text):
+    # preprocess() from scoring.ipynb before scoring/preprocess.py
+    text = text.lower()  # Convert to lowercase
+    text = re.sub(r"[^\w\s]", "", text)  # Remove punctuation
+    stop_words = set(stopwords.words("english"))
+    word_tokens = word_tokenize(text)
+    lemmatizer = WordNetLemmatizer()
+    cleaned_text = " ".join(
+        [lemmatizer.lemmatize(word) for word in word_tokens if word not in stop_words]
+    )
+    return cleaned_text
+
+
+def make_synthetic_menu_texts(num_items: int) -> List[str]:
+    # Name and description of menu items drawn from a small food vocabulary with
+    # a long tail of rarer words, like real menus
+    vocabulary = _FOOD_WORDS + [f"{word}s" for word in _FOOD_WORDS]
+    rare_words = [f"special{i}" for i in range(num_items // 10)]
+    texts = []
+    for _ in range(num_items):
+        name = " ".join(random.choices(vocabulary, k=random.randint(2, 4))).title()
+        words = random.choices(vocabulary + _FILLER_WORDS, k=random.randint(6, 20))
+        words.append(random.choice(rare_words))
+        texts.append(f"{name} {', '.join(words)}.")
+    return texts
+
+
+def _time(name: str, preprocess_texts: Callable, texts: List[str]) -> List:
+    # Every run starts with a cold lemma cache, also in the forked workers
+    _lemmatize.cache_clear()
+    start = time.perf_counter()
+    preprocess_texts(texts)
+    elapsed = time.perf_counter() - start
+    return [name, len(texts), elapsed, len(texts) / elapsed]
+
+
+def main(
+    num_items: int = 100000,
+    baseline_items: Optional[int] = None,
+    processes: int = PREPROCESS_PROCESSES,
+):
+    # The notebook function against preprocess() in this process and
+    # preprocess_batch() on a process pool. baseline_items limits the items the much
+    # slower notebook function runs on, its speed is per item either way
+    ensure_nltk_data()
+    random.seed(0)
+    texts = make_synthetic_menu_texts(num_items)
+    baseline_texts = texts[:baseline_items] if baseline_items else texts
+
+    mismatches = sum(
+        _notebook_preprocess(text) != preprocess(text) for text in texts[:1000]
+    )
+    print(f"{mismatches} of the first 1000 texts where the functions disagree")
+
+    rows = [
+        _time(
+            "notebook preprocess",
+            lambda texts: [_notebook_preprocess(text) for text in texts],
+            baseline_texts,
+        ),
+        _time(
+            "preprocess_batch(processes=1)",
+            lambda texts: preprocess_batch(texts, processes=1),
+            texts,
+        ),
+        _time(
+            f"preprocess_batch(processes={processes})",
+            lambda texts: preprocess_batch(texts, processes=processes),
+            texts,
+        ),
+    ]
+    print(f"{'function':<36}{'items':>10}{'secs':>10}{'items/s':>12}{'speedup':>10}")
+    for name, items, elapsed, items_per_sec in rows:
+        speedup = items_per_sec / rows[0][3]
+        print(
+            f"{name:<36}{items:>10}{elapsed:>10.2f}{items_per_sec:>12.0f}"
+            f"{speedup:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
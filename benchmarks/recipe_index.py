@@ -0,0 +1,138 @@
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import fire
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from scoring.preprocess import (
+    ensure_nltk_data,
+    get_dish_text,
+    get_recipe_text,
+    preprocess_batch,
+)
+from scoring.similarity import (
+    TopKSimilarities,
+    build_recipe_index,
+    get_approximate_top_k_similarities,
+    get_top_k_similarities,
+)
+from utils.snapshot import load_snapshot
+from utils.utils import SIMILARITY_TOP_K
+
+
+def make_synthetic_texts(
+    num_dishes: int,
+    num_recipes: int,
+    vocabulary_size: int = 20000,
+    num_cuisines: int = 1000,
+    seed: int = 0,
+) -> Tuple[List[str], List[str]]:
+    # Dishes and recipes drawn half from the words of a cuisine and half from a
+    # Zipf distributed vocabulary, so every dish has a few clearly closest recipes
+    # and common words link it to most of the others, like real menus
+    rng = np.random.default_rng(seed)
+    word_probabilities = 1 / np.arange(1, vocabulary_size + 1)
+    word_probabilities /= word_probabilities.sum()
+    cuisines = rng.integers(vocabulary_size, size=(num_cuisines, 15))
+
+    def make_texts(num_texts: int, num_words: int) -> List[str]:
+        cuisine_words = cuisines[rng.integers(num_cuisines, size=num_texts)]
+        words = np.concatenate(
+            [
+                np.take_along_axis(
+                    cuisine_words,
+                    rng.integers(15, size=(num_texts, num_words // 2)),
+                    axis=1,
+                ),
+                rng.choice(
+                    vocabulary_size,
+                    size=(num_texts, num_words - num_words // 2),
+                    p=word_probabilities,
+                ),
+            ],
+            axis=1,
+        )
+        return [" ".join(f"word{word}" for word in text) for text in words]
+
+    return make_texts(num_dishes, 10), make_texts(num_recipes, 20)
+
+
+def _load_snapshot_texts(snapshot_dir: str) -> Tuple[List[str], List[str]]:
+    snapshot = load_snapshot(snapshot_dir)
+    item_texts = snapshot.tables["item_text"]
+    recipes = snapshot.tables["recipe"]
+    ensure_nltk_data()
+    dish_texts = preprocess_batch(
+        get_dish_text(name, description)
+        for name, description in zip(item_texts["name"], item_texts["description"])
+    )
+    recipe_texts = preprocess_batch(
+        get_recipe_text(name, ingredients)
+        for name, ingredients in zip(recipes["name"], recipes["ingredients"])
+    )
+    return dish_texts, recipe_texts
+
+
+def get_recall(exact: TopKSimilarities, approximate: TopKSimilarities) -> float:
+    # Fraction of the exact top k recipes of every dish the approximate top k has
+    found = (
+        exact.recipe_indexes[:, :, None] == approximate.recipe_indexes[:, None, :]
+    ).any(axis=2) & (exact.recipe_indexes >= 0)
+    return found.sum() / max((exact.recipe_indexes >= 0).sum(), 1)
+
+
+def main(
+    num_dishes: int = 20000,
+    num_recipes: int = 20000,
+    snapshot_dir: Optional[str] = None,
+    query_words: Sequence[int] = (2, 3, 5, 8),
+    postings: Sequence[int] = (30, 100, 300),
+    top_k: int = SIMILARITY_TOP_K,
+):
+    # Exact top k against the index for every combination of query words and
+    # postings per word, on synthetic texts or, with snapshot_dir, on the dishes and
+    # recipes of the latest snapshot. Scoring saves the max similarity of a dish, so
+    # how often it is exact matters as much as recall
+    if snapshot_dir:
+        dish_texts, recipe_texts = _load_snapshot_texts(snapshot_dir)
+    else:
+        dish_texts, recipe_texts = make_synthetic_texts(num_dishes, num_recipes)
+    vectorizer = TfidfVectorizer()
+    dish_vectors = vectorizer.fit_transform(dish_texts)
+    recipe_vectors = vectorizer.transform(recipe_texts)
+    print(f"{dish_vectors.shape[0]} dishes, {recipe_vectors.shape[0]} recipes")
+
+    start = time.perf_counter()
+    exact = get_top_k_similarities(dish_vectors, recipe_vectors, top_k)
+    exact_secs = time.perf_counter() - start
+    print(f"exact: {exact_secs:.2f}s")
+
+    print(
+        f"{'words':>6}{'postings':>10}{'build s':>9}{'query s':>9}{'speedup':>9}"
+        f"{'max cand':>11}{f'recall@{top_k}':>11}{'max exact':>11}{'max err':>10}"
+    )
+    for num_postings in postings:
+        start = time.perf_counter()
+        recipe_index = build_recipe_index(recipe_vectors, num_postings)
+        build_secs = time.perf_counter() - start
+        for num_query_words in query_words:
+            start = time.perf_counter()
+            approximate = get_approximate_top_k_similarities(
+                recipe_index, dish_vectors, top_k, num_query_words
+            )
+            query_secs = time.perf_counter() - start
+            # Upper bound on the recipes a dish is compared with
+            candidates = min(num_query_words * num_postings, recipe_vectors.shape[0])
+            max_exact = np.isclose(approximate.max_scores, exact.max_scores).mean()
+            max_error = np.abs(exact.max_scores - approximate.max_scores).mean()
+            print(
+                f"{num_query_words:>6}{num_postings:>10}{build_secs:>9.2f}"
+                f"{query_secs:>9.2f}{exact_secs / query_secs:>8.1f}x{candidates:>11}"
+                f"{get_recall(exact, approximate):>11.3f}{max_exact:>11.3f}"
+                f"{max_error:>10.4f}"
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -1,22 +1,34 @@
+from datetime import timedelta
 from itertools import chain
 import json
-import random
-import time
-from typing import List, NamedTuple, Optional
-from tqdm import tqdm
+from typing import Callable, List, NamedTuple, Optional
+from urllib.parse import urlsplit, urlunsplit
 from bs4 import BeautifulSoup
 from prefect import flow, task
 from prefect_ray.task_runners import RayTaskRunner
 from prefect_ray.context import remote_options
 
-import requests
-
+from utils.extraction import extract_links
+from utils.fetch import FetchResult, fetch_all
+from utils.frontier import CrawlStage, FrontierEntry, drain_stage, get_crawl_frontier
+from utils.rate_limit import get_rate_limiter
 from utils.utils import (
-    DEFAULT_SLEEP_SEC,
-    REQUEST_GET_TIMEOUT_SECS,
-    TASK_TIMEOUT_SECONDS,
+    CRAWL_FRONTIER_DIR,
+    DISCOVERY_MAX_WINDOW_PAGES,
+    FETCH_BATCH_SIZE,
+    RECIPES_CRAWL_TTL_HOURS,
+    canonicalize_url,
+)
+from utils.db_utils import (
+    DbTable,
+    RecipeInfo,
+    create_db_tables,
+    flush_db_writer,
+    get_db_writer,
+    get_fresh_recipe_urls_from_db,
+    wait_for_db_writes,
+    write_to_db,
 )
-from utils.db_utils import RecipeInfo, create_db_tables, save_recipe_to_db
 
 TASK_TIMEOUT_30_MIN = 1800
 
@@ -33,94 +45,121 @@ class RecipeUrl(NamedTuple):
     type: UrlType
 
 
-def _get_allrecipes_urls(offset: int) -> List[str]:
-    # increment by 24 from offset
-    return f"https://www.allrecipes.com/search?vegetarian=vegetarian&offset={offset+24}&q=vegetarian"
+RECIPE_HEADERS = {UrlType.NYT_COOKING: {"User-Agent": "Mozilla/5.0"}}
 
 
-@task(timeout_seconds=TASK_TIMEOUT_30_MIN)
-def get_allrecipes_urls(num_recipes_limit: int) -> List[RecipeUrl]:
-    # 30 min timeout, unlikely
+def _get_allrecipes_page_url(url: str) -> str:
+    # allrecipes serves every page at its path with a trailing slash, which the
+    # canonical url used by the frontier drops. Fetching it that way skips a redirect,
+    # and recipes are saved under the url they always were
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=f"{parts.path.rstrip('/')}/"))
+
+
+def _get_recipe_url(entry: FrontierEntry) -> RecipeUrl:
+    if entry.url.startswith("https://cooking.nytimes.com"):
+        return RecipeUrl(url=entry.url, type=UrlType.NYT_COOKING)
+    return RecipeUrl(url=_get_allrecipes_page_url(entry.url), type=UrlType.ALLRECIPES)
+
+
+def _get_allrecipes_urls(page_index: int) -> str:
+    # 24 recipes per page
+    return f"https://www.allrecipes.com/search?vegetarian=vegetarian&offset={page_index * 24}&q=vegetarian"
+
+
+def _parse_allrecipes_search_page(page_text: str) -> List[RecipeUrl]:
+    links = extract_links(page_text, "https://www.allrecipes.com/recipes/", "main")
+    return [
+        RecipeUrl(url=canonicalize_url(link["href"]), type=UrlType.ALLRECIPES)
+        for link in links or []
+    ]
+
+
+def _get_nytcooking_urls(page_index: int) -> str:
+    return f"https://cooking.nytimes.com/search?q=vegetarian&tags=vegetarian&page={page_index + 1}"
+
+
+def _parse_nytcooking_search_page(page_text: str) -> List[RecipeUrl]:
+    return [
+        RecipeUrl(
+            url=canonicalize_url(f"https://cooking.nytimes.com{link['href']}"),
+            type=UrlType.NYT_COOKING,
+        )
+        for link in extract_links(page_text, "/recipes/")
+    ]
+
+
+def discover_recipe_urls(
+    url_type: UrlType,
+    get_page_url: Callable[[int], str],
+    parse_page: Callable[[str], List[RecipeUrl]],
+    num_recipes_limit: int,
+    recipes_per_page: int,
+) -> List[RecipeUrl]:
+    # Search pages are numbered, so a window of them is fetched concurrently, sized
+    # from the recipes still missing and the recipes per page seen so far. Pages of a
+    # window are consumed in order and discovery stops at the first failed or empty
+    # page, like a serial walk would, or once the limit is reached
     all_recipe_urls = []
-    try:
-        offset = -24
-        while len(all_recipe_urls) < num_recipes_limit:
-            try:
-                url = _get_allrecipes_urls(offset=offset)
-                response = requests.get(url, timeout=REQUEST_GET_TIMEOUT_SECS)
-                soup = BeautifulSoup(response.text, "html.parser")
-
-                cur_page_recipe_urls = []
-                main_element = soup.find("main")
-                if main_element:
-                    for a_element in tqdm(main_element.find_all("a", href=True)):
-                        href = a_element["href"]
-                        if href.startswith("https://www.allrecipes.com/recipes/"):
-                            cur_page_recipe_urls.append(
-                                RecipeUrl(url=href, type=UrlType.ALLRECIPES)
-                            )
-
-                if not cur_page_recipe_urls:
-                    print(f"Could not find any recipe urls at offset {offset}")
-                    break
-                all_recipe_urls.extend(cur_page_recipe_urls)
-                offset += 24
+    page_index = 0
+    while len(all_recipe_urls) < num_recipes_limit:
+        missing_recipes = num_recipes_limit - len(all_recipe_urls)
+        if page_index:
+            recipes_per_page = max(len(all_recipe_urls) // page_index, 1)
+        window_pages = min(
+            -(-missing_recipes // recipes_per_page), DISCOVERY_MAX_WINDOW_PAGES
+        )
+        page_urls = [get_page_url(page_index + i) for i in range(window_pages)]
+        for result in fetch_all(page_urls, headers=RECIPE_HEADERS.get(url_type)):
+            if not result.ok:
                 print(
-                    f"Found {len(all_recipe_urls)} recipe urls so far at offset {offset}"
+                    f"Could not get {url_type} urls from {result.url}, status {result.status}: {result.error}"
                 )
+                return all_recipe_urls
+            try:
+                cur_page_recipe_urls = parse_page(result.text)
             except Exception as e:
-                print(f"Could not get allrecipes urls with offset {offset}: {e}")
+                print(f"Could not get {url_type} urls from {result.url}: {e}")
+                return all_recipe_urls
+            if not cur_page_recipe_urls:
+                print(f"Could not find any recipe urls at {result.url}")
+                return all_recipe_urls
+            all_recipe_urls.extend(cur_page_recipe_urls)
+            page_index += 1
+            if len(all_recipe_urls) >= num_recipes_limit:
                 break
-        return all_recipe_urls
-    except Exception as e:
-        print(f"Could not get allrecipes urls: {e}")
-        return all_recipe_urls
+        print(
+            f"Found {len(all_recipe_urls)} {url_type} urls so far in {page_index} pages"
+        )
+    return all_recipe_urls
 
 
-def _get_nytcooking_urls(page_num: int) -> List[str]:
-    return f"https://cooking.nytimes.com/search?q=vegetarian&tags=vegetarian&page={page_num}"
+@task(timeout_seconds=TASK_TIMEOUT_30_MIN)
+def get_allrecipes_urls(num_recipes_limit: int) -> List[RecipeUrl]:
+    return discover_recipe_urls(
+        UrlType.ALLRECIPES,
+        _get_allrecipes_urls,
+        _parse_allrecipes_search_page,
+        num_recipes_limit,
+        recipes_per_page=24,
+    )
 
 
 @task(timeout_seconds=TASK_TIMEOUT_30_MIN)
 def get_nytcooking_urls(num_recipes_limit: int) -> List[RecipeUrl]:
-    all_recipe_urls = []
-    try:
-        page_num = 1
-        while len(all_recipe_urls) < num_recipes_limit:
-            try:
-                url = _get_nytcooking_urls(page_num=page_num)
-                response = requests.get(url, timeout=REQUEST_GET_TIMEOUT_SECS)
-                soup = BeautifulSoup(response.text, "html.parser")
-
-                cur_page_recipe_urls = []
-                for a_element in tqdm(soup.find_all("a", href=True)):
-                    href = a_element["href"]
-                    if href.startswith("/recipes/"):
-                        cur_page_recipe_urls.append(
-                            RecipeUrl(
-                                url=f"https://cooking.nytimes.com{href}",
-                                type=UrlType.NYT_COOKING,
-                            )
-                        )
-
-                all_recipe_urls.extend(cur_page_recipe_urls)
-
-                print(
-                    f"Found {len(all_recipe_urls)} recipe urls so far at page {page_num}"
-                )
-                page_num += 1
-            except Exception as e:
-                print(f"Could not get nyt cooking urls with page {page_num}: {e}")
-                break
-        return all_recipe_urls
-    except Exception as e:
-        print(f"Could not get nyt cooking urls: {e}")
-        return all_recipe_urls
+    return discover_recipe_urls(
+        UrlType.NYT_COOKING,
+        _get_nytcooking_urls,
+        _parse_nytcooking_search_page,
+        num_recipes_limit,
+        recipes_per_page=24,
+    )
 
 
-def process_direct_recipe_url_allrecipes(recipe_url: RecipeUrl) -> Optional[RecipeInfo]:
-    response = requests.get(recipe_url.url, timeout=REQUEST_GET_TIMEOUT_SECS)
-    soup = BeautifulSoup(response.text, "html.parser")
+def process_direct_recipe_url_allrecipes(
+    recipe_url: RecipeUrl, page_text: str
+) -> Optional[RecipeInfo]:
+    soup = BeautifulSoup(page_text, "html.parser")
     h1_element = soup.find("h1")
     name = h1_element.text.strip() if h1_element else None
     if not name:
@@ -139,18 +178,11 @@ def process_direct_recipe_url_allrecipes(recipe_url: RecipeUrl) -> Optional[Reci
     return RecipeInfo(name=name, ingredients=ingredients_str, url=recipe_url.url)
 
 
-def process_direct_recipe_url_nytcooking(recipe_url: RecipeUrl) -> Optional[RecipeInfo]:
-    requests.packages.urllib3.disable_warnings()
-
-    # Get the page source
-    page_source = requests.get(
-        recipe_url.url,
-        headers={"User-Agent": "Mozilla/5.0"},
-        timeout=REQUEST_GET_TIMEOUT_SECS,
-    ).content
-
+def process_direct_recipe_url_nytcooking(
+    recipe_url: RecipeUrl, page_text: str
+) -> Optional[RecipeInfo]:
     # Parse the page source with BeautifulSoup
-    soup = BeautifulSoup(page_source, "lxml")
+    soup = BeautifulSoup(page_text, "lxml")
     script = soup.find("script", {"id": "__NEXT_DATA__"})
     script_content = script.contents[0]
     script_dict = json.loads(script_content)
@@ -168,41 +200,31 @@ def process_direct_recipe_url_nytcooking(recipe_url: RecipeUrl) -> Optional[Reci
 
 
 def process_direct_recipe_url(
-    recipe_url: RecipeUrl, sleep_sec: Optional[float] = DEFAULT_SLEEP_SEC
+    recipe_url: RecipeUrl, page_text: str
 ) -> Optional[RecipeInfo]:
-    time.sleep(random.uniform(0, sleep_sec))
     try:
         if recipe_url.type == UrlType.ALLRECIPES:
-            return process_direct_recipe_url_allrecipes(recipe_url=recipe_url)
+            return process_direct_recipe_url_allrecipes(recipe_url, page_text)
         elif recipe_url.type == UrlType.NYT_COOKING:
-            return process_direct_recipe_url_nytcooking(recipe_url=recipe_url)
+            return process_direct_recipe_url_nytcooking(recipe_url, page_text)
     except Exception as e:
         print(f"Could not process recipe url {recipe_url}: {e}")
         return None
 
 
-def process_collection_recipe_url_allrecipes(
-    recipe_url: RecipeUrl,
-) -> Optional[List[str]]:
-    response = requests.get(recipe_url.url, timeout=REQUEST_GET_TIMEOUT_SECS)
-    soup = BeautifulSoup(response.text, "html.parser")
-    recipe_urls = []
-    main_element = soup.find("main")
-    if main_element:
-        for a_element in main_element.find_all("a", href=True):
-            href = a_element["href"]
-            if href.startswith("https://www.allrecipes.com/recipe/"):
-                recipe_urls.append(href)
-        return recipe_urls
-    return None
+def process_collection_recipe_url_allrecipes(page_text: str) -> Optional[List[str]]:
+    links = extract_links(page_text, "https://www.allrecipes.com/recipe/", "main")
+    if links is None:
+        return None
+    return [link["href"] for link in links]
 
 
 def get_recipe_urls_from_collection_url(
-    recipe_url: RecipeUrl,
+    recipe_url: RecipeUrl, page_text: str
 ) -> Optional[List[str]]:
     try:
         if recipe_url.type == UrlType.ALLRECIPES:
-            return process_collection_recipe_url_allrecipes(recipe_url=recipe_url)
+            return process_collection_recipe_url_allrecipes(page_text)
         elif recipe_url.type == UrlType.NYT_COOKING:
             return None
     except Exception as e:
@@ -210,67 +232,119 @@ def get_recipe_urls_from_collection_url(
         return None
 
 
-def save_recipe_to_db_hook(task, task_run, state) -> None:
-    recipes = state.result()
-    if not recipes:
-        return
-    for recipe in recipes:
-        if recipe:
-            try:
-                save_recipe_to_db(recipe)
-            except Exception as e:
-                print(
-                    f"Could not save recipe {recipe} to DB. Maybe it already exists in the DB: {e}"
-                )
+def fetch_recipe_pages(recipe_urls: List[RecipeUrl]) -> List[FetchResult]:
+    # Each source gets its own headers, the results keep the order of recipe_urls
+    results = {}
+    for url_type in (UrlType.ALLRECIPES, UrlType.NYT_COOKING):
+        urls = [
+            recipe_url.url for recipe_url in recipe_urls if recipe_url.type == url_type
+        ]
+        for result in fetch_all(urls, headers=RECIPE_HEADERS.get(url_type)):
+            results[result.url] = result
+    return [results[recipe_url.url] for recipe_url in recipe_urls]
 
 
-@task(on_completion=[save_recipe_to_db_hook], timeout_seconds=TASK_TIMEOUT_30_MIN)
-def process_recipe_url(
-    original_recipe_url: RecipeUrl,
-    sleep_sec: Optional[float] = DEFAULT_SLEEP_SEC,
-) -> Optional[List[RecipeInfo]]:
-    try:
-        # All NYT cooking recipes, but only some AllRecipe, recipes are direct recipes
-        recipe_info = process_direct_recipe_url(original_recipe_url, sleep_sec)
+class RecipeBatch(NamedTuple):
+    recipe_infos: List[RecipeInfo]
+    # Recipes listed by the collection pages in the batch, to be fetched by other tasks
+    collection_recipe_urls: List[str]
+
+
+@task(timeout_seconds=TASK_TIMEOUT_30_MIN)
+def process_recipe_urls(entries: List[FrontierEntry]) -> RecipeBatch:
+    recipe_infos = []
+    collection_recipe_urls = []
+    recipe_urls = [_get_recipe_url(entry) for entry in entries]
+
+    # All NYT cooking recipes, but only some AllRecipe, recipes are direct recipes
+    for recipe_url, result in zip(recipe_urls, fetch_recipe_pages(recipe_urls)):
+        if not result.ok:
+            print(
+                f"Could not get recipe url {recipe_url}, status {result.status}: {result.error}"
+            )
+            continue
+        recipe_info = process_direct_recipe_url(recipe_url, result.text)
         if recipe_info:
-            return [recipe_info]
-        else:
-            recipe_infos = []
-            # Must be a page that list recipes, so get the direct recipe urls and process them
-            actual_recipe_urls: Optional[
-                List[str]
-            ] = get_recipe_urls_from_collection_url(original_recipe_url)
-            if not actual_recipe_urls:
-                return None
-            for actual_recipe_url in actual_recipe_urls:
-                recipe_info = process_direct_recipe_url(
-                    RecipeUrl(url=actual_recipe_url, type=original_recipe_url.type),
-                    sleep_sec,
-                )
-                if recipe_info:
-                    recipe_infos.append(recipe_info)
-            return recipe_infos
-    except Exception as e:
-        print(f"Could not process recipe url {original_recipe_url}: {e}")
-        return None
+            recipe_infos.append(recipe_info)
+            continue
+        # Must be a page that list recipes, its recipes go back into the frontier
+        urls: Optional[List[str]] = get_recipe_urls_from_collection_url(
+            recipe_url, result.text
+        )
+        if urls:
+            print(f"Found {len(urls)} recipe urls in collection {recipe_url.url}")
+            collection_recipe_urls.extend(canonicalize_url(url) for url in urls)
+    # Written by the task itself rather than an on_completion hook, so the recipes
+    # reach the DB writer before the flow sees the task completed
+    if recipe_infos:
+        wait_for_db_writes([write_to_db(DbTable.RECIPE, recipe_infos)])
+    return RecipeBatch(recipe_infos, collection_recipe_urls)
 
 
 @flow(task_runner=RayTaskRunner())
-def recipes_flow():
+def recipes_flow(crawl_ttl_hours: float = RECIPES_CRAWL_TTL_HOURS):
     num_cpus = 10
-    sleep_sec = num_cpus * 0.2
     num_recipes_limit = 100
+    crawl_ttl = timedelta(hours=crawl_ttl_hours)
 
     # 1
     create_db_tables()
+    # Created by the flow so the shared rate limiter lives as long as the flow run
+    get_rate_limiter()
+    # Likewise the single DB writer all tasks hand their records to
+    get_db_writer()
 
     # 2
-    allrecipes_urls = get_allrecipes_urls(num_recipes_limit)
-    nytcooking_urls = get_nytcooking_urls(num_recipes_limit, wait_for=[allrecipes_urls])
-    # allrecipes_urls = []
-    # nytcooking_urls = get_nytcooking_urls(num_recipes_limit)
+    # Both sources are discovered at the same time
+    allrecipes_urls_future = get_allrecipes_urls.submit(num_recipes_limit)
+    nytcooking_urls_future = get_nytcooking_urls.submit(num_recipes_limit)
+    allrecipes_urls = allrecipes_urls_future.result()
+    nytcooking_urls = nytcooking_urls_future.result()
+
+    # Pending pages of an interrupted run are picked up from the frontier, entries
+    # that are already done or pending aren't queued again
+    frontier = get_crawl_frontier(CRAWL_FRONTIER_DIR, "recipes_flow")
+    # Urls are canonical, so the frontier also drops the same recipe found through
+    # another search page, collection or source. Recipes crawled within the ttl by
+    # earlier runs are never queued, the DB has the url a page was fetched at so its
+    # urls are canonicalized too
+    fresh_recipe_urls = {
+        canonicalize_url(url) for url in get_fresh_recipe_urls_from_db(crawl_ttl)
+    }
+
+    def get_recipe_entries(recipe_urls: List[str]) -> List[FrontierEntry]:
+        return [
+            FrontierEntry(CrawlStage.RECIPE, url)
+            for url in recipe_urls
+            if url not in fresh_recipe_urls
+        ]
+
+    new_recipe_urls = frontier.put(
+        get_recipe_entries(
+            [recipe_url.url for recipe_url in chain(allrecipes_urls, nytcooking_urls)]
+        )
+    )
+    print(f"Queued {new_recipe_urls} new recipe urls")
 
     with remote_options(num_cpus=num_cpus):
         # 3
-        for recipe_url in chain(allrecipes_urls, nytcooking_urls):
-            process_recipe_url.submit(recipe_url, sleep_sec)
+        # Each task fetches a whole batch of pages concurrently with the async fetch engine
+        drain_stage(
+            frontier,
+            CrawlStage.RECIPE,
+            process_recipe_urls.submit,
+            FETCH_BATCH_SIZE,
+            # Collections are expanded by queueing their recipes as recipe pages, so
+            # the recipes of a large collection are spread over all the workers
+            lambda recipe_batch: get_recipe_entries(
+                recipe_batch.collection_recipe_urls
+            ),
+        )
+
+    # 4
+    flush_db_writer()
+    pending = frontier.pending(CrawlStage.RECIPE)
+    if pending:
+        print(f"{pending} pages are left in the frontier for the next run")
+    else:
+        frontier.clear()
@@ -16,6 +16,7 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+from utils.extraction import extract_menu_items
 from utils.utils import (
     BASE_HEADERS,
     BASE_UE_URL,
@@ -65,31 +66,9 @@ def get_and_populate_items_experimental(restaurant: Restaurant) -> None:
     full_url = f"{BASE_UE_URL}{restaurant.rel_url}?diningMode=DELIVERY&pl=JTdCJTIyYWRkcmVzcyUyMiUzQSUyMkNvdmFyaWFudC5haSUyMiUyQyUyMnJlZmVyZW5jZSUyMiUzQSUyMkNoSUpFdzRlTTBaX2hZQVJVY21OTmp4MlREbyUyMiUyQyUyMnJlZmVyZW5jZVR5cGUlMjIlM0ElMjJnb29nbGVfcGxhY2VzJTIyJTJDJTIybGF0aXR1ZGUlMjIlM0EzNy44NDExNTc2JTJDJTIybG9uZ2l0dWRlJTIyJTNBLTEyMi4yOTU4MTMxJTdE"
     print(f"Getting items from restaurant: {restaurant.name} with url: {full_url}")
     res = requests.get(full_url, headers=BASE_HEADERS)
-    page_info = BeautifulSoup(res.text, features="html.parser")
-    matches = page_info.find_all("script", type="application/ld+json")
     all_item_infos = []
     try:
-        for match in matches:
-            match = json.loads(match.text)
-            if match.get("@type") == "Restaurant":
-                menu = match.get("hasMenu")
-                if menu:
-                    menu_selection = menu.get("hasMenuSection")
-                    if menu_selection:
-                        for menu in menu_selection:
-                            menu_items = menu.get("hasMenuItem")
-                            if menu_items:
-                                for item in menu_items:
-                                    name, description = item.get("name"), item.get(
-                                        "description"
-                                    )
-                                    dummy_rel_url = f"{name}+{restaurant.id}"
-                                    # TODO: drop rel_url col fro DB and info
-                                    item_info = ItemInfo(
-                                        name, description, dummy_rel_url
-                                    )
-                                    all_item_infos.append(item_info)
-                break
+        all_item_infos = extract_menu_items(res.text, restaurant.id)
         save_items_to_db(restaurant, all_item_infos)
     except Exception as e:
         print(
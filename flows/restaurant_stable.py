@@ -1,195 +1,192 @@
-import json
-import random
-import time
+from datetime import timedelta
 from typing import List, Optional
+from urllib.parse import urlsplit
 
-from bs4 import BeautifulSoup
 from prefect import flow, task
 from prefect_ray.task_runners import RayTaskRunner
 from prefect_ray.context import remote_options
-import requests
 
 
+from utils.extraction import (
+    extract_links,
+    extract_menu_items,
+    extract_restaurant_cards,
+)
+from utils.fetch import fetch_all
+from utils.frontier import CrawlStage, FrontierEntry, drain_stage, get_crawl_frontier
+from utils.rate_limit import get_rate_limiter
 from utils.utils import (
-    DEFAULT_SLEEP_SEC,
-    REQUEST_GET_TIMEOUT_SECS,
+    BATCH_TASK_TIMEOUT_SECONDS,
+    CRAWL_FRONTIER_DIR,
+    FETCH_BATCH_SIZE,
+    RESTAURANTS_CRAWL_TTL_HOURS,
     TASK_TIMEOUT_SECONDS,
-    BASE_HEADERS,
     BASE_UE_URL,
+    canonicalize_url,
     parse_city,
 )
 from utils.db_utils import (
     Category,
     CategoryInfo,
+    DbTable,
     Item,
     ItemInfo,
     Restaurant,
     RestaurantInfo,
     create_db_tables,
-    get_categories_from_db,
     get_items_from_db,
-    get_restaurants_from_db,
-    save_categories_to_db,
-    save_restaurants_to_db,
-    save_items_to_db,
+    get_stale_categories_from_db,
+    get_stale_restaurants_from_db,
+    flush_db_writer,
+    get_db_writer,
+    wait_for_db_writes,
+    write_to_db,
 )
 
 
-def _get_rating_from_restaurant_box(restaurant_box: BeautifulSoup) -> int:
-    for child in restaurant_box.findChildren("div", recursive=True):
-        try:
-            rating = float(child.text)
-            return rating
-        except Exception:
-            continue
-    return 0
+def _get_store_url(restaurant: Restaurant) -> str:
+    # full_url = "https://www.ubereats.com/store/la-estrella-food-truck/1S1RJ9zXQC23uwBxwtXR3A?diningMode=DELIVERY&pl=JTdCJTIyYWRkcmVzcyUyMiUzQSUyMkNvdmFyaWFudC5haSUyMiUyQyUyMnJlZmVyZW5jZSUyMiUzQSUyMkNoSUpFdzRlTTBaX2hZQVJVY21OTmp4MlREbyUyMiUyQyUyMnJlZmVyZW5jZVR5cGUlMjIlM0ElMjJnb29nbGVfcGxhY2VzJTIyJTJDJTIybGF0aXR1ZGUlMjIlM0EzNy44NDExNTc2JTJDJTIybG9uZ2l0dWRlJTIyJTNBLTEyMi4yOTU4MTMxJTdE"
+    return f"{BASE_UE_URL}{restaurant.rel_url}?diningMode=DELIVERY&pl=JTdCJTIyYWRkcmVzcyUyMiUzQSUyMkNvdmFyaWFudC5haSUyMiUyQyUyMnJlZmVyZW5jZSUyMiUzQSUyMkNoSUpFdzRlTTBaX2hZQVJVY21OTmp4MlREbyUyMiUyQyUyMnJlZmVyZW5jZVR5cGUlMjIlM0ElMjJnb29nbGVfcGxhY2VzJTIyJTJDJTIybGF0aXR1ZGUlMjIlM0EzNy44NDExNTc2JTJDJTIybG9uZ2l0dWRlJTIyJTNBLTEyMi4yOTU4MTMxJTdE"
+
+
+def _get_store_rel_url(href: str) -> str:
+    # A store is identified by its path, the query only holds the dining mode and
+    # where the link was on the page, which differs between categories
+    return urlsplit(canonicalize_url(href)).path
+
+
+def _get_category(entry: FrontierEntry) -> Category:
+    # The frontier only keeps what the tasks need, not the whole row
+    return Category(id=entry.entity_id, name=entry.name)
 
 
-@task
-def get_items_in_restaurant(
-    restaurant: Restaurant,
-    sleep_sec: Optional[float] = DEFAULT_SLEEP_SEC,
+def _get_restaurant(entry: FrontierEntry) -> Restaurant:
+    return Restaurant(id=entry.entity_id, name=entry.name)
+
+
+@task(timeout_seconds=BATCH_TASK_TIMEOUT_SECONDS)
+def get_items_in_restaurants(
+    entries: List[FrontierEntry],
 ) -> List[ItemInfo]:
-    time.sleep(random.uniform(0, sleep_sec))
-    # full_url = "https://www.ubereats.com/store/la-estrella-food-truck/1S1RJ9zXQC23uwBxwtXR3A?diningMode=DELIVERY&pl=JTdCJTIyYWRkcmVzcyUyMiUzQSUyMkNvdmFyaWFudC5haSUyMiUyQyUyMnJlZmVyZW5jZSUyMiUzQSUyMkNoSUpFdzRlTTBaX2hZQVJVY21OTmp4MlREbyUyMiUyQyUyMnJlZmVyZW5jZVR5cGUlMjIlM0ElMjJnb29nbGVfcGxhY2VzJTIyJTJDJTIybGF0aXR1ZGUlMjIlM0EzNy44NDExNTc2JTJDJTIybG9uZ2l0dWRlJTIyJTNBLTEyMi4yOTU4MTMxJTdE"
-    full_url = f"{BASE_UE_URL}{restaurant.rel_url}?diningMode=DELIVERY&pl=JTdCJTIyYWRkcmVzcyUyMiUzQSUyMkNvdmFyaWFudC5haSUyMiUyQyUyMnJlZmVyZW5jZSUyMiUzQSUyMkNoSUpFdzRlTTBaX2hZQVJVY21OTmp4MlREbyUyMiUyQyUyMnJlZmVyZW5jZVR5cGUlMjIlM0ElMjJnb29nbGVfcGxhY2VzJTIyJTJDJTIybGF0aXR1ZGUlMjIlM0EzNy44NDExNTc2JTJDJTIybG9uZ2l0dWRlJTIyJTNBLTEyMi4yOTU4MTMxJTdE"
-    print(f"Getting items from restaurant: {restaurant.name} with url: {full_url}")
-    res = requests.get(full_url, headers=BASE_HEADERS, timeout=REQUEST_GET_TIMEOUT_SECS)
-    page_info = BeautifulSoup(res.text, features="html.parser")
-    matches = page_info.find_all("script", type="application/ld+json")
     all_item_infos = []
-    try:
-        for match in matches:
-            match = json.loads(match.text)
-            if match.get("@type") == "Restaurant":
-                menu = match.get("hasMenu")
-                if menu:
-                    menu_selection = menu.get("hasMenuSection")
-                    if menu_selection:
-                        for menu in menu_selection:
-                            menu_items = menu.get("hasMenuItem")
-                            if menu_items:
-                                for item in menu_items:
-                                    name, description = item.get("name"), item.get(
-                                        "description"
-                                    )
-                                    dummy_rel_url = f"{name}+{restaurant.id}"
-                                    # TODO: drop rel_url col fro DB and info
-                                    item_info = ItemInfo(
-                                        name, description, dummy_rel_url
-                                    )
-                                    all_item_infos.append(item_info)
-                break
-        print(
-            f"Saving {len(all_item_infos)} items for restaurant: {restaurant.name} to DB"
-        )
-        save_items_to_db(restaurant, all_item_infos)
-    except Exception as e:
-        print(
-            f"While getting items from restaurant: {restaurant.name}, got exception: {e}"
-        )
-    finally:
-        return all_item_infos
+    write_refs = []
 
+    print(f"Getting items from {len(entries)} restaurants")
+    results = fetch_all([entry.url for entry in entries])
+    for restaurant, result in zip(map(_get_restaurant, entries), results):
+        if not result.ok:
+            print(
+                f"Could not get items from restaurant: {restaurant.name} with url: {result.url}, status {result.status}: {result.error}"
+            )
+            continue
+        try:
+            item_infos = extract_menu_items(result.text, restaurant.id)
+            print(
+                f"Saving {len(item_infos)} items for restaurant: {restaurant.name} to DB"
+            )
+            write_refs.append(write_to_db(DbTable.ITEM, item_infos, restaurant.id))
+            all_item_infos.extend(item_infos)
+        except Exception as e:
+            print(
+                f"While getting items from restaurant: {restaurant.name}, got exception: {e}"
+            )
+    wait_for_db_writes(write_refs)
+    return all_item_infos
 
-@task(timeout_seconds=TASK_TIMEOUT_SECONDS)
-def get_restaurants_in_category(
-    category: Category,
+
+@task(timeout_seconds=BATCH_TASK_TIMEOUT_SECONDS)
+def get_restaurants_in_categories(
+    entries: List[FrontierEntry],
     restaurants_limit: Optional[int],
-    sleep_sec: Optional[float] = DEFAULT_SLEEP_SEC,
 ) -> List[RestaurantInfo]:
-    time.sleep(random.uniform(0, sleep_sec))
-    restaurants = []
-
-    try:
-        # TODO: filter out restaurants that are too far for delivery
-        category_res = requests.get(
-            f"{BASE_UE_URL}{category.rel_url}",
-            headers=BASE_HEADERS,
-            timeout=REQUEST_GET_TIMEOUT_SECS,
-        )
-        page_info = BeautifulSoup(category_res.text, features="html.parser")
-
-        enumerated = 0
-        for header in page_info.find_all("h3"):
-            if restaurants_limit is not None and enumerated == restaurants_limit:
-                break
-            try:
-                if header.parent is None or header.parent.get("href") is None:
-                    continue
-                rel_restaurant_url = header.parent.get("href")
-                # Some urls might not be a restaurant
-                if rel_restaurant_url.startswith("/store"):
-                    restaurant_name = header.get_text()
-                    rating = _get_rating_from_restaurant_box(header.parent.parent)
-                    restaurants.append(
-                        RestaurantInfo(restaurant_name, rating, rel_restaurant_url)
-                    )
-                    enumerated += 1
-            except Exception as e:
-                print(
-                    f"While getting restaurant from match: {header}, got exception: {e}"
-                )
-                continue
+    all_restaurants = []
+    write_refs = []
 
-        print(f"Found {len(restaurants)} restaurants in {category.name}")
-        save_restaurants_to_db(category, restaurants)
-    except Exception as e:
-        print(
-            f"While getting restaurants in category: {category.name}, got exception: {e}"
-        )
-    finally:
-        return restaurants
+    results = fetch_all([entry.url for entry in entries])
+    for category, result in zip(map(_get_category, entries), results):
+        if not result.ok:
+            print(
+                f"Could not get restaurants in category: {category.name}, status {result.status}: {result.error}"
+            )
+            continue
+        try:
+            # TODO: filter out restaurants that are too far for delivery
+            restaurants = [
+                restaurant._replace(rel_url=_get_store_rel_url(restaurant.rel_url))
+                for restaurant in extract_restaurant_cards(
+                    result.text, "/store", restaurants_limit
+                )
+            ]
+            print(f"Found {len(restaurants)} restaurants in {category.name}")
+            write_refs.append(write_to_db(DbTable.RESTAURANT, restaurants, category.id))
+            all_restaurants.extend(restaurants)
+        except Exception as e:
+            print(
+                f"While getting restaurants in category: {category.name}, got exception: {e}"
+            )
+    wait_for_db_writes(write_refs)
+    return all_restaurants
 
 
-@task(timeout_seconds=TASK_TIMEOUT_SECONDS)
-def get_categories_in_city(
-    city: str,
-    categories_limit: Optional[int] = None,
-    sleep_sec: Optional[float] = DEFAULT_SLEEP_SEC,
+def parse_categories_in_city(
+    city: str, page_text: str, categories_limit: Optional[int]
 ) -> List[CategoryInfo]:
-    time.sleep(random.uniform(0, sleep_sec))
+    matches = extract_links(page_text, "/category", within_tag="main")
+    if matches is None:
+        print(f"Could not find the main element on the categories page for {city}")
+        return []
     categories = []
 
-    try:
-        categories_url = f"{BASE_UE_URL}/category/{parse_city(city)}"
-        categories_res = requests.get(
-            categories_url, headers=BASE_HEADERS, timeout=REQUEST_GET_TIMEOUT_SECS
-        )
-        page_info = BeautifulSoup(categories_res.text, features="html.parser")
-        matches = page_info.find("main").find_all(
-            "a", href=lambda href: href and href.startswith("/category")
-        )
+    final_categories_limit = categories_limit or len(matches)
+    for i, match in enumerate(matches):
+        if i == final_categories_limit:
+            break
+        try:
+            name, rel_url = match.get("data-test"), match.get("href")
+            categories.append(CategoryInfo(name, rel_url))
+        except Exception as e:
+            print(f"While getting category from match: {match}, got exception: {e}")
+            continue
 
-        final_categories_limit = categories_limit or len(matches)
-        for i, match in enumerate(matches):
-            if i == final_categories_limit:
-                break
-            try:
-                name, rel_url = match.get("data-test"), match.get("href")
-                categories.append(CategoryInfo(name, rel_url))
-            except Exception as e:
-                print(f"While getting category from match: {match}, got exception: {e}")
-                continue
+    print(
+        f"Found {len(categories)} categories out of {len(matches)} matches for {city}."
+    )
+    return categories
 
-        print(
-            f"Saving {final_categories_limit} categories out of {len(matches)} matches for {city}."
-        )
-        save_categories_to_db(categories)
-    except Exception as e:
-        print(f"While getting categories for city: {city}, got exception: {e}")
-    finally:
-        return categories
+
+@task(timeout_seconds=BATCH_TASK_TIMEOUT_SECONDS)
+def get_categories_in_cities(
+    entries: List[FrontierEntry],
+    categories_limit: Optional[int] = None,
+) -> List[CategoryInfo]:
+    all_categories = []
+    write_refs = []
+
+    results = fetch_all([entry.url for entry in entries])
+    for city, result in zip([entry.name for entry in entries], results):
+        if not result.ok:
+            print(
+                f"Could not get categories for city: {city}, status {result.status}: {result.error}"
+            )
+            continue
+        try:
+            categories = parse_categories_in_city(city, result.text, categories_limit)
+            write_refs.append(write_to_db(DbTable.CATEGORY, categories))
+            all_categories.extend(categories)
+        except Exception as e:
+            print(f"While getting categories for city: {city}, got exception: {e}")
+    wait_for_db_writes(write_refs)
+    return all_categories
 
 
 @task(timeout_seconds=TASK_TIMEOUT_SECONDS)
-def get_categories_from_db_task() -> List[Category]:
-    return get_categories_from_db()
+def get_stale_categories_from_db_task(crawl_ttl: timedelta) -> List[Category]:
+    return get_stale_categories_from_db(crawl_ttl)
 
 
 @task(timeout_seconds=TASK_TIMEOUT_SECONDS)
-def get_restaurants_from_db_task() -> List[Restaurant]:
-    return get_restaurants_from_db()
+def get_stale_restaurants_from_db_task(crawl_ttl: timedelta) -> List[Restaurant]:
+    return get_stale_restaurants_from_db(crawl_ttl)
 
 
 @task(timeout_seconds=TASK_TIMEOUT_SECONDS)
@@ -198,13 +195,14 @@ def get_items_from_db_task() -> List[Item]:
 
 
 @flow(task_runner=RayTaskRunner())
-def restaurants_flow():
+def restaurants_flow(crawl_ttl_hours: float = RESTAURANTS_CRAWL_TTL_HOURS):
     # cities = ["Emeryville", "Oakland"]
     # categories_limit, restaurants_limit, items_limit = 2, 2, 2
     cities = ["Emeryville", "Oakland", "Berkeley", "Alameda", "Albany"]
     categories_limit, restaurants_limit = None, None
     num_cpus = 10
-    sleep_sec = num_cpus * 0.2
+    # Only categories and restaurants not crawled within the ttl are fetched again
+    crawl_ttl = timedelta(hours=crawl_ttl_hours)
 
     print(
         f"Starting the flow with cities {cities}, {categories_limit} categories, and {restaurants_limit} restaurants per restaurant for the DB."
@@ -212,20 +210,86 @@ def restaurants_flow():
 
     # 1
     create_db_tables()
+    # Created by the flow so the shared rate limiter lives as long as the flow run
+    get_rate_limiter()
+    # Likewise the single DB writer all tasks hand their records to
+    get_db_writer()
 
-    with remote_options(num_cpus=num_cpus):
-        # 2
-        category_futures = [
-            get_categories_in_city.submit(city, categories_limit, sleep_sec)
+    # Pending pages of an interrupted run are picked up from the frontier, entries
+    # that are already done or pending aren't queued again
+    frontier = get_crawl_frontier(CRAWL_FRONTIER_DIR, "restaurants_flow")
+    frontier.put(
+        [
+            FrontierEntry(
+                CrawlStage.CITY, f"{BASE_UE_URL}/category/{parse_city(city)}", name=city
+            )
             for city in cities
         ]
+    )
+
+    with remote_options(num_cpus=num_cpus):
+        # Each task fetches a whole batch of pages concurrently with the async fetch engine
+        # 2
+        drain_stage(
+            frontier,
+            CrawlStage.CITY,
+            lambda entries: get_categories_in_cities.submit(entries, categories_limit),
+            FETCH_BATCH_SIZE,
+        )
         # 3
-        categories = get_categories_from_db_task(wait_for=category_futures)
-        restaurant_futures = [
-            get_restaurants_in_category.submit(category, restaurants_limit, sleep_sec)
-            for category in categories
-        ]
+        flush_db_writer()
+        categories = get_stale_categories_from_db_task(crawl_ttl)
+        new_categories = frontier.put(
+            [
+                FrontierEntry(
+                    CrawlStage.CATEGORY,
+                    f"{BASE_UE_URL}{category.rel_url}",
+                    category.id,
+                    category.name,
+                )
+                for category in categories
+            ]
+        )
+        print(f"{len(categories)} categories are due for a crawl, {new_categories} new")
+        drain_stage(
+            frontier,
+            CrawlStage.CATEGORY,
+            lambda entries: get_restaurants_in_categories.submit(
+                entries, restaurants_limit
+            ),
+            FETCH_BATCH_SIZE,
+        )
         # 4
-        restaurants = get_restaurants_from_db_task(wait_for=restaurant_futures)
-        for restaurant in restaurants:
-            get_items_in_restaurant.submit(restaurant, sleep_sec)
+        flush_db_writer()
+        restaurants = get_stale_restaurants_from_db_task(crawl_ttl)
+        new_restaurants = frontier.put(
+            [
+                FrontierEntry(
+                    CrawlStage.STORE,
+                    _get_store_url(restaurant),
+                    restaurant.id,
+                    restaurant.name,
+                )
+                for restaurant in restaurants
+            ]
+        )
+        print(
+            f"{len(restaurants)} restaurants are due for a crawl, {new_restaurants} new"
+        )
+        drain_stage(
+            frontier,
+            CrawlStage.STORE,
+            get_items_in_restaurants.submit,
+            FETCH_BATCH_SIZE,
+        )
+
+    # 5
+    flush_db_writer()
+    pending = sum(
+        frontier.pending(stage)
+        for stage in [CrawlStage.CITY, CrawlStage.CATEGORY, CrawlStage.STORE]
+    )
+    if pending:
+        print(f"{pending} pages are left in the frontier for the next run")
+    else:
+        frontier.clear()
@@ -1,17 +1,120 @@
+import os
+import sys
+import time
+from typing import Callable, Optional
+
 import fire
 from flows.restaurant_stable import restaurants_flow
 from flows.recipes_stable import recipes_flow
+from scoring.engine import run_scoring
+from utils.query_plans import check_query_plans
+from utils.replay import HTTP_ARCHIVE_ENV_VAR, HTTP_MODE_ENV_VAR, HttpMode
+from utils.snapshot import export_snapshot
+from utils.utils import (
+    PREPROCESS_PROCESSES,
+    RECIPES_CRAWL_TTL_HOURS,
+    RESTAURANTS_CRAWL_TTL_HOURS,
+    SCORING_CHUNK_SIZE,
+    SCORING_MODEL_DIR,
+    SNAPSHOT_DIR,
+)
+
+
+def _run_flow(
+    flow: Callable, http_mode: str, archive: Optional[str], **flow_kwargs
+) -> None:
+    # Set through the environment so the Ray workers started by the flow pick it up
+    os.environ[HTTP_MODE_ENV_VAR] = http_mode
+    if archive:
+        os.environ[HTTP_ARCHIVE_ENV_VAR] = archive
+    start = time.perf_counter()
+    flow(**flow_kwargs)
+    print(f"{flow.name} finished in {time.perf_counter() - start:.1f}s ({http_mode})")
 
 
 class Main(object):
     def __init__(self):
         pass
 
-    def restaurants_flow(self):
-        restaurants_flow()
+    def restaurants_flow(
+        self,
+        http_mode: str = HttpMode.LIVE,
+        archive: Optional[str] = None,
+        crawl_ttl_hours: float = RESTAURANTS_CRAWL_TTL_HOURS,
+    ):
+        # crawl_ttl_hours=0 recrawls everything
+        _run_flow(restaurants_flow, http_mode, archive, crawl_ttl_hours=crawl_ttl_hours)
+
+    def recipes_flow(
+        self,
+        http_mode: str = HttpMode.LIVE,
+        archive: Optional[str] = None,
+        crawl_ttl_hours: float = RECIPES_CRAWL_TTL_HOURS,
+    ):
+        _run_flow(recipes_flow, http_mode, archive, crawl_ttl_hours=crawl_ttl_hours)
+
+    def check_query_plans(self, db_url: Optional[str] = None):
+        # Fails when one of the core queries reads a whole table
+        query_plans = check_query_plans(db_url)
+        for query_plan in query_plans:
+            status = "FULL SCAN" if query_plan.full_table_scans else "ok"
+            print(f"{query_plan.name}: {status}")
+            for line in query_plan.plan:
+                print(f"    {line}")
+        if any(query_plan.full_table_scans for query_plan in query_plans):
+            sys.exit(1)
+
+    def export_snapshot(self, snapshot_dir: str = SNAPSHOT_DIR):
+        # Columnar copy of the DB that notebooks and scoring memory map at startup
+        start = time.perf_counter()
+        snapshot = export_snapshot(snapshot_dir)
+        elapsed = time.perf_counter() - start
+        print(f"Exported snapshot {snapshot.path} in {elapsed:.1f}s")
+        for table, columns in snapshot.tables.items():
+            print(f"    {table}: {len(columns['id'])} rows")
 
-    def recipes_flow(self):
-        recipes_flow()
+    def score(
+        self,
+        chunk_size: int = SCORING_CHUNK_SIZE,
+        snapshot_dir: str = SNAPSHOT_DIR,
+        export: bool = True,
+        dry_run: bool = False,
+        processes: int = PREPROCESS_PROCESSES,
+        full: bool = False,
+        model_dir: str = SCORING_MODEL_DIR,
+        ann: bool = False,
+    ):
+        # Scores only new and changed items and their restaurants with the model of
+        # the last full run. --full refits on and scores every item and restaurant
+        # from a fresh snapshot, or the latest one with --export=False. --dry_run only
+        # reports timings without saving scores. --ann finds every dish's closest
+        # recipes with an approximate index rather than comparing it with all of them
+        start = time.perf_counter()
+        result = run_scoring(
+            snapshot_dir,
+            chunk_size,
+            export,
+            not dry_run,
+            processes,
+            full,
+            model_dir,
+            ann,
+        )
+        print(
+            f"Scored {result.num_items} items ({result.num_dishes} distinct dishes) "
+            f"against {result.num_recipes} recipes and {result.num_restaurants} "
+            f"restaurants in {time.perf_counter() - start:.1f}s"
+        )
+        for stage, elapsed in result.timings.items():
+            print(f"    {stage}: {elapsed:.2f}s")
+        if result.drift is not None:
+            print(
+                f"Since the last full fit: {result.drift.new_dishes_fraction:.1%} new "
+                f"dishes, {result.drift.oov_tokens_fraction:.1%} of their words out "
+                f"of vocabulary, {result.drift.num_new_recipes} new recipes"
+            )
+            for reason in result.drift.reasons:
+                print(f"Full refit recommended (python main.py score --full): {reason}")
 
 
 if __name__ == "__main__":
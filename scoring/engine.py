@@ -0,0 +1,359 @@
+from contextlib import contextmanager
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import spmatrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from scoring.preprocess import (
+    ensure_nltk_data,
+    get_dish_text,
+    get_recipe_text,
+    preprocess_batch,
+)
+from scoring.model import (
+    ScoringModel,
+    ScoringModelStats,
+    load_scoring_model,
+    save_scoring_model,
+    update_scoring_model_stats,
+)
+from scoring.similarity import (
+    RecipeIndex,
+    TopKSimilarities,
+    build_recipe_index,
+    get_approximate_top_k_similarities,
+    get_top_k_similarities,
+)
+from utils.db_utils import (
+    get_recipe_ids_query,
+    iter_query_chunks,
+    iter_unscored_items_from_db,
+    iter_unscored_restaurant_ids_from_db,
+    save_item_scores_to_db,
+    save_restaurant_scores_to_db,
+    update_restaurant_scores_in_db,
+)
+from utils.snapshot import Snapshot, export_snapshot, get_id_indexes, load_snapshot
+from utils.utils import (
+    PREPROCESS_PROCESSES,
+    REFIT_NEW_DISHES_FRACTION,
+    REFIT_OOV_TOKENS_FRACTION,
+    SCORING_CHUNK_SIZE,
+    SCORING_MODEL_DIR,
+    SNAPSHOT_DIR,
+)
+
+
+# ScoringStage Enum
+class ScoringStage:
+    SNAPSHOT = "snapshot"
+    MODEL = "model"
+    READ_CHANGES = "read changes"
+    PREPROCESS = "preprocess"
+    VECTORIZE = "vectorize"
+    SIMILARITY = "similarity"
+    RESTAURANT_SCORES = "restaurant scores"
+    SAVE = "save"
+
+
+class DriftReport(NamedTuple):
+    # Distinct dishes scored incrementally since the last full fit, relative to the
+    # dishes it was fit on
+    new_dishes_fraction: float
+    # Words of these dishes missing from the fitted vocabulary, which don't count
+    # towards their similarity to any recipe
+    oov_tokens_fraction: float
+    # Recipes crawled since the fit, no dish is compared against them
+    num_new_recipes: int
+    # Why a full refit is recommended, empty while incremental runs are fine
+    reasons: List[str]
+
+
+class ScoringResult(NamedTuple):
+    num_items: int
+    num_dishes: int
+    num_recipes: int
+    num_restaurants: int
+    # stage -> seconds, in the order the stages ran
+    timings: Dict[str, float]
+    # Ids of the scored dishes and, per dish, of its closest recipes and their
+    # similarities. -1 past the recipes that share a word with the dish
+    dish_ids: Optional[np.ndarray] = None
+    top_recipe_ids: Optional[np.ndarray] = None
+    top_recipe_scores: Optional[np.ndarray] = None
+    # Set by incremental runs, which only score new and changed items
+    drift: Optional[DriftReport] = None
+
+
+class StageTimer:
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + (
+                time.perf_counter() - start
+            )
+
+
+def get_restaurant_scores(
+    restaurant_ids: np.ndarray, item_scores: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Mean item score per restaurant, items without a restaurant (-1) are skipped
+    has_restaurant = restaurant_ids >= 0
+    unique_restaurant_ids, restaurant_indexes = np.unique(
+        restaurant_ids[has_restaurant], return_inverse=True
+    )
+    score_sums = np.bincount(restaurant_indexes, weights=item_scores[has_restaurant])
+    item_counts = np.bincount(restaurant_indexes)
+    return unique_restaurant_ids, score_sums / np.maximum(item_counts, 1)
+
+
+def get_drift_report(stats: ScoringModelStats, num_new_recipes: int) -> DriftReport:
+    new_dishes_fraction = stats.num_new_dishes / max(stats.num_fitted_dishes, 1)
+    oov_tokens_fraction = stats.num_new_oov_tokens / max(stats.num_new_tokens, 1)
+    reasons = []
+    if new_dishes_fraction >= REFIT_NEW_DISHES_FRACTION:
+        reasons.append(
+            f"{stats.num_new_dishes} dishes were scored incrementally since the fit "
+            f"on {stats.num_fitted_dishes}"
+        )
+    if oov_tokens_fraction >= REFIT_OOV_TOKENS_FRACTION:
+        reasons.append(
+            f"{oov_tokens_fraction:.0%} of the words of new dishes aren't in the "
+            "fitted vocabulary"
+        )
+    if num_new_recipes:
+        reasons.append(f"{num_new_recipes} recipes were crawled since the fit")
+    return DriftReport(
+        new_dishes_fraction, oov_tokens_fraction, num_new_recipes, reasons
+    )
+
+
+def _get_similarities(
+    dish_vectors: spmatrix, recipe_index: RecipeIndex, chunk_size: int, ann: bool
+) -> TopKSimilarities:
+    # ann compares every dish with only the recipes the index finds for it instead of
+    # with all of them
+    if not ann:
+        return get_top_k_similarities(
+            dish_vectors, recipe_index.recipe_vectors, chunk_size=chunk_size
+        )
+    return get_approximate_top_k_similarities(
+        recipe_index, dish_vectors, chunk_size=chunk_size
+    )
+
+
+def _get_top_recipe_ids(
+    recipe_ids: np.ndarray, recipe_indexes: np.ndarray
+) -> np.ndarray:
+    return np.where(recipe_indexes >= 0, np.asarray(recipe_ids)[recipe_indexes], -1)
+
+
+def score_snapshot(
+    snapshot: Snapshot,
+    chunk_size: int = SCORING_CHUNK_SIZE,
+    save: bool = True,
+    timer: Optional[StageTimer] = None,
+    processes: int = PREPROCESS_PROCESSES,
+    model_dir: str = SCORING_MODEL_DIR,
+    ann: bool = False,
+) -> ScoringResult:
+    # preprocess -> TF-IDF -> cosine similarity to the recipes -> max per dish ->
+    # mean per restaurant, like scoring.ipynb. Every distinct dish is scored once and
+    # its items get its score. Saving also saves the fitted model for incremental runs
+    timer = timer or StageTimer()
+    items = snapshot.tables["item"]
+    item_texts = snapshot.tables["item_text"]
+    recipes = snapshot.tables["recipe"]
+    if not len(item_texts["id"]) or not len(recipes["id"]):
+        print("Nothing to score, the snapshot has no items or no recipes")
+        return ScoringResult(len(items["id"]), 0, len(recipes["id"]), 0, timer.timings)
+    # Position of every item's dish, checked before any of the work
+    item_dish_indexes = get_id_indexes(item_texts["id"], items["item_text_id"])
+
+    with timer.stage(ScoringStage.PREPROCESS):
+        ensure_nltk_data()
+        dish_texts = preprocess_batch(
+            (
+                get_dish_text(name, description)
+                for name, description in zip(
+                    item_texts["name"], item_texts["description"]
+                )
+            ),
+            processes,
+        )
+        recipe_texts = preprocess_batch(
+            (
+                get_recipe_text(name, ingredients)
+                for name, ingredients in zip(recipes["name"], recipes["ingredients"])
+            ),
+            processes,
+        )
+
+    with timer.stage(ScoringStage.VECTORIZE):
+        vectorizer = TfidfVectorizer()
+        dish_vectors = vectorizer.fit_transform(dish_texts)
+        recipe_vectors = vectorizer.transform(recipe_texts)
+        del dish_texts, recipe_texts
+
+    with timer.stage(ScoringStage.SIMILARITY):
+        # Built even for exact scoring, it is saved with the model so incremental ann
+        # runs never rebuild it
+        recipe_index = build_recipe_index(recipe_vectors)
+        similarities = _get_similarities(dish_vectors, recipe_index, chunk_size, ann)
+        item_scores = similarities.max_scores[item_dish_indexes]
+        top_recipe_ids = _get_top_recipe_ids(recipes["id"], similarities.recipe_indexes)
+
+    with timer.stage(ScoringStage.RESTAURANT_SCORES):
+        restaurant_ids, restaurant_scores = get_restaurant_scores(
+            items["restaurant_id"], item_scores
+        )
+
+    if save:
+        with timer.stage(ScoringStage.SAVE):
+            save_item_scores_to_db(items["id"], item_scores, items["item_text_id"])
+            save_restaurant_scores_to_db(restaurant_ids, restaurant_scores)
+            save_scoring_model(
+                vectorizer,
+                recipes["id"],
+                recipe_index,
+                item_texts["id"],
+                model_dir,
+            )
+
+    return ScoringResult(
+        len(items["id"]),
+        len(item_texts["id"]),
+        len(recipes["id"]),
+        len(restaurant_ids),
+        timer.timings,
+        np.asarray(item_texts["id"]),
+        top_recipe_ids,
+        similarities.scores,
+    )
+
+
+def score_changes(
+    model: ScoringModel,
+    chunk_size: int = SCORING_CHUNK_SIZE,
+    save: bool = True,
+    timer: Optional[StageTimer] = None,
+    processes: int = PREPROCESS_PROCESSES,
+    ann: bool = False,
+) -> ScoringResult:
+    # Scores only the items that are new or whose text changed with the vocabulary,
+    # IDF and recipe vectors of the last full run, then recomputes the score of only
+    # the restaurants these items or a changed menu belong to. Reads the DB directly,
+    # what changed is usually a small part of it
+    timer = timer or StageTimer()
+    with timer.stage(ScoringStage.READ_CHANGES):
+        rows = [row for rows in iter_unscored_items_from_db() for row in rows]
+        restaurant_ids = {
+            row[0] for rows in iter_unscored_restaurant_ids_from_db() for row in rows
+        }
+        restaurant_ids.update(row[1] for row in rows if row[1] is not None)
+        recipe_ids = [
+            row[0] for rows in iter_query_chunks(get_recipe_ids_query()) for row in rows
+        ]
+        num_new_recipes = int(np.count_nonzero(~np.isin(recipe_ids, model.recipe_ids)))
+    item_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    item_text_ids = np.array([row[2] for row in rows], dtype=np.int64)
+    dish_ids, dish_rows, item_dish_indexes = np.unique(
+        item_text_ids, return_index=True, return_inverse=True
+    )
+    item_scores = np.zeros(len(item_ids))
+    top_recipe_ids = np.full((len(dish_ids), 0), -1)
+    top_recipe_scores = np.zeros((len(dish_ids), 0))
+    # Dishes the model never saw, items of a new store of a chain mostly aren't
+    unseen_dishes = ~np.isin(dish_ids, model.dish_ids) & ~np.isin(
+        dish_ids, model.new_dish_ids
+    )
+    new_dish_ids = np.union1d(model.new_dish_ids, dish_ids[unseen_dishes])
+    stats = model.stats
+
+    if len(dish_ids):
+        with timer.stage(ScoringStage.PREPROCESS):
+            ensure_nltk_data()
+            dish_texts = preprocess_batch(
+                (get_dish_text(*rows[row][3:]) for row in dish_rows), processes
+            )
+
+        with timer.stage(ScoringStage.VECTORIZE):
+            dish_vectors = model.vectorizer.transform(dish_texts)
+            analyzer = model.vectorizer.build_analyzer()
+            num_tokens = num_oov_tokens = 0
+            for dish_text in np.array(dish_texts, dtype=object)[unseen_dishes]:
+                tokens = analyzer(dish_text)
+                num_tokens += len(tokens)
+                num_oov_tokens += sum(
+                    token not in model.vectorizer.vocabulary_ for token in tokens
+                )
+            stats = stats._replace(
+                num_new_dishes=len(new_dish_ids),
+                num_new_tokens=stats.num_new_tokens + num_tokens,
+                num_new_oov_tokens=stats.num_new_oov_tokens + num_oov_tokens,
+            )
+
+        with timer.stage(ScoringStage.SIMILARITY):
+            similarities = _get_similarities(
+                dish_vectors, model.recipe_index, chunk_size, ann
+            )
+            item_scores = similarities.max_scores[item_dish_indexes]
+            top_recipe_ids = _get_top_recipe_ids(
+                model.recipe_ids, similarities.recipe_indexes
+            )
+            top_recipe_scores = similarities.scores
+
+    if save:
+        with timer.stage(ScoringStage.SAVE):
+            save_item_scores_to_db(item_ids, item_scores, item_text_ids)
+        with timer.stage(ScoringStage.RESTAURANT_SCORES):
+            update_restaurant_scores_in_db(list(restaurant_ids))
+        with timer.stage(ScoringStage.MODEL):
+            model = update_scoring_model_stats(model, new_dish_ids, stats)
+
+    return ScoringResult(
+        len(item_ids),
+        len(dish_ids),
+        len(model.recipe_ids),
+        len(restaurant_ids),
+        timer.timings,
+        dish_ids,
+        top_recipe_ids,
+        top_recipe_scores,
+        get_drift_report(stats, num_new_recipes),
+    )
+
+
+def run_scoring(
+    snapshot_dir: str = SNAPSHOT_DIR,
+    chunk_size: int = SCORING_CHUNK_SIZE,
+    export: bool = True,
+    save: bool = True,
+    processes: int = PREPROCESS_PROCESSES,
+    full: bool = False,
+    model_dir: str = SCORING_MODEL_DIR,
+    ann: bool = False,
+) -> ScoringResult:
+    # Scores what changed since the last run with its saved model. full=True, or no
+    # saved model, refits on and scores a fresh snapshot of the DB, or the latest
+    # one with export=False
+    timer = StageTimer()
+    if not full:
+        with timer.stage(ScoringStage.MODEL):
+            model = load_scoring_model(model_dir)
+        if model is not None:
+            return score_changes(model, chunk_size, save, timer, processes, ann)
+        print("No scoring model saved yet, scoring everything")
+    with timer.stage(ScoringStage.SNAPSHOT):
+        snapshot = (
+            export_snapshot(snapshot_dir) if export else load_snapshot(snapshot_dir)
+        )
+    return score_snapshot(snapshot, chunk_size, save, timer, processes, model_dir, ann)
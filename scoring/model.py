@@ -0,0 +1,165 @@
+from datetime import datetime
+import json
+import os
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+from scipy.sparse import load_npz, save_npz
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from scoring.similarity import RecipeIndex, build_recipe_index
+from utils.snapshot import (
+    LATEST_SNAPSHOT_FILE,
+    MANIFEST_FILE,
+    get_latest_version,
+    publish_version,
+)
+from utils.utils import RECIPE_INDEX_POSTINGS, SCORING_MODEL_DIR
+
+# Bumped whenever the layout of a saved model changes, older models can't be loaded
+SCORING_MODEL_FORMAT_VERSION = 3
+VOCABULARY_FILE = "vocabulary.json"
+IDF_FILE = "idf.npy"
+RECIPE_IDS_FILE = "recipe_ids.npy"
+RECIPE_VECTORS_FILE = "recipe_vectors.npz"
+RECIPE_POSTINGS_FILE = "recipe_postings.npz"
+DISH_IDS_FILE = "dish_ids.npy"
+NEW_DISH_IDS_FILE = "new_dish_ids.npy"
+# Models kept by a full run, older ones are removed
+SCORING_MODELS_TO_KEEP = 2
+
+
+class ScoringModelStats(NamedTuple):
+    # Distinct dishes the vocabulary and IDF were fit on
+    num_fitted_dishes: int
+    # Distinct dishes first scored by incremental runs since, and how many of their
+    # words are missing from the vocabulary
+    num_new_dishes: int = 0
+    num_new_tokens: int = 0
+    num_new_oov_tokens: int = 0
+
+
+class ScoringModel(NamedTuple):
+    version: str
+    path: str
+    vectorizer: TfidfVectorizer
+    recipe_ids: np.ndarray
+    # One normalized TF-IDF row per recipe id and the index approximate scoring
+    # looks dishes up in, built once by the full run
+    recipe_index: RecipeIndex
+    # Sorted item_text ids of the dishes the model was fit on, and of those first
+    # scored by incremental runs since
+    dish_ids: np.ndarray
+    new_dish_ids: np.ndarray
+    stats: ScoringModelStats
+
+
+def _write_manifest(
+    path: str, version: str, recipe_index_postings: int, stats: ScoringModelStats
+) -> None:
+    manifest = {
+        "format_version": SCORING_MODEL_FORMAT_VERSION,
+        "version": version,
+        "recipe_index_postings": recipe_index_postings,
+        "stats": stats._asdict(),
+    }
+    tmp_manifest_path = os.path.join(path, f".{MANIFEST_FILE}.tmp")
+    with open(tmp_manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(tmp_manifest_path, os.path.join(path, MANIFEST_FILE))
+
+
+def save_scoring_model(
+    vectorizer: TfidfVectorizer,
+    recipe_ids: np.ndarray,
+    recipe_index: RecipeIndex,
+    dish_ids: np.ndarray,
+    model_dir: str = SCORING_MODEL_DIR,
+) -> ScoringModel:
+    # Saves a fitted vectorizer as its vocabulary and IDF rather than a pickle, so it
+    # loads with any scikit-learn version. Published like a snapshot version
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    tmp_path = os.path.join(model_dir, f".{version}.tmp")
+    os.makedirs(tmp_path)
+    vocabulary = {word: int(index) for word, index in vectorizer.vocabulary_.items()}
+    with open(os.path.join(tmp_path, VOCABULARY_FILE), "w") as vocabulary_file:
+        json.dump(vocabulary, vocabulary_file)
+    np.save(os.path.join(tmp_path, IDF_FILE), vectorizer.idf_)
+    np.save(os.path.join(tmp_path, RECIPE_IDS_FILE), np.asarray(recipe_ids))
+    save_npz(os.path.join(tmp_path, RECIPE_VECTORS_FILE), recipe_index.recipe_vectors)
+    save_npz(os.path.join(tmp_path, RECIPE_POSTINGS_FILE), recipe_index.postings)
+    np.save(os.path.join(tmp_path, DISH_IDS_FILE), np.unique(dish_ids))
+    np.save(os.path.join(tmp_path, NEW_DISH_IDS_FILE), np.zeros(0, dtype=np.int64))
+    _write_manifest(
+        tmp_path,
+        version,
+        recipe_index.postings_per_word,
+        ScoringModelStats(len(np.unique(dish_ids))),
+    )
+
+    publish_version(model_dir, tmp_path, version, SCORING_MODELS_TO_KEEP)
+    return load_scoring_model(model_dir, version)
+
+
+def load_scoring_model(
+    model_dir: str = SCORING_MODEL_DIR, version: Optional[str] = None
+) -> Optional[ScoringModel]:
+    # The latest model by default, None when no full run saved one yet
+    if version is None:
+        if not os.path.isfile(os.path.join(model_dir, LATEST_SNAPSHOT_FILE)):
+            return None
+        version = get_latest_version(model_dir)
+    path = os.path.join(model_dir, version)
+    with open(os.path.join(path, MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest["format_version"] != SCORING_MODEL_FORMAT_VERSION:
+        print(
+            f"Scoring model {version} has format version "
+            f"{manifest['format_version']}, expected {SCORING_MODEL_FORMAT_VERSION}"
+        )
+        return None
+
+    with open(os.path.join(path, VOCABULARY_FILE)) as vocabulary_file:
+        vocabulary: Dict[str, int] = json.load(vocabulary_file)
+    vectorizer = TfidfVectorizer(vocabulary=vocabulary)
+    vectorizer.idf_ = np.load(os.path.join(path, IDF_FILE))
+    recipe_index = RecipeIndex(
+        load_npz(os.path.join(path, RECIPE_VECTORS_FILE)).tocsr(),
+        load_npz(os.path.join(path, RECIPE_POSTINGS_FILE)).tocsr(),
+        manifest["recipe_index_postings"],
+    )
+    if recipe_index.postings_per_word != RECIPE_INDEX_POSTINGS:
+        # Only the index depends on the setting, no need for a full run
+        print(
+            f"Rebuilding the recipe index of scoring model {version} with "
+            f"{RECIPE_INDEX_POSTINGS} postings per word instead of "
+            f"{recipe_index.postings_per_word}"
+        )
+        recipe_index = build_recipe_index(
+            recipe_index.recipe_vectors, RECIPE_INDEX_POSTINGS
+        )
+    return ScoringModel(
+        version,
+        path,
+        vectorizer,
+        np.load(os.path.join(path, RECIPE_IDS_FILE)),
+        recipe_index,
+        np.load(os.path.join(path, DISH_IDS_FILE)),
+        np.load(os.path.join(path, NEW_DISH_IDS_FILE)),
+        ScoringModelStats(**manifest["stats"]),
+    )
+
+
+def update_scoring_model_stats(
+    model: ScoringModel, new_dish_ids: np.ndarray, stats: ScoringModelStats
+) -> ScoringModel:
+    # The manifest is written last, the stats it holds never count dishes missing
+    # from new_dish_ids
+    tmp_new_dish_ids_path = os.path.join(model.path, f".{NEW_DISH_IDS_FILE}")
+    with open(tmp_new_dish_ids_path, "wb") as new_dish_ids_file:
+        np.save(new_dish_ids_file, new_dish_ids)
+    os.replace(tmp_new_dish_ids_path, os.path.join(model.path, NEW_DISH_IDS_FILE))
+    _write_manifest(
+        model.path, model.version, model.recipe_index.postings_per_word, stats
+    )
+    return model._replace(new_dish_ids=new_dish_ids, stats=stats)
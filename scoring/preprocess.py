@@ -0,0 +1,89 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import re
+from typing import Iterable, List, Optional, Set
+
+import nltk
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+
+from utils.utils import LEMMA_CACHE_SIZE, PREPROCESS_BATCH_SIZE, PREPROCESS_PROCESSES
+
+# (nltk.data path, package) of the NLTK data preprocessing needs
+NLTK_RESOURCES = [
+    ("corpora/stopwords", "stopwords"),
+    ("corpora/wordnet", "wordnet"),
+    ("tokenizers/punkt", "punkt"),
+]
+PUNCTUATION_RE = re.compile(r"[^\w\s]")
+
+
+def ensure_nltk_data() -> None:
+    # Only downloads what isn't installed yet, so scheduled runs work offline
+    for path, package in NLTK_RESOURCES:
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(package, quiet=True)
+
+
+@lru_cache(maxsize=None)
+def _get_stop_words() -> Set[str]:
+    return set(stopwords.words("english"))
+
+
+@lru_cache(maxsize=None)
+def _get_lemmatizer() -> WordNetLemmatizer:
+    return WordNetLemmatizer()
+
+
+# Menus and recipes reuse a small vocabulary, so most words are looked up in WordNet
+# only once per process
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def _lemmatize(word: str) -> str:
+    return _get_lemmatizer().lemmatize(word)
+
+
+def preprocess(text: str) -> str:
+    # Same steps as scoring.ipynb: lowercase, remove punctuation and stop words and
+    # lemmatize what is left
+    text = PUNCTUATION_RE.sub("", text.lower())
+    stop_words = _get_stop_words()
+    return " ".join(
+        _lemmatize(word) for word in word_tokenize(text) if word not in stop_words
+    )
+
+
+def _preprocess_texts(texts: List[str]) -> List[str]:
+    return [preprocess(text) for text in texts]
+
+
+def preprocess_batch(
+    texts: Iterable[str],
+    processes: int = PREPROCESS_PROCESSES,
+    batch_size: int = PREPROCESS_BATCH_SIZE,
+) -> List[str]:
+    # Preprocessed texts in the same order, batch_size texts per task on a pool of
+    # processes. Batches are large so every worker's lemma cache gets warm, a single
+    # batch or processes=1 runs in this process
+    texts = list(texts)
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    if processes <= 1 or len(batches) <= 1:
+        return [text for batch in batches for text in _preprocess_texts(batch)]
+    # Loaded before the pool forks so every worker doesn't read them again
+    _get_stop_words()
+    _lemmatize("dishes")
+    with ProcessPoolExecutor(min(processes, len(batches))) as executor:
+        return [
+            text for batch in executor.map(_preprocess_texts, batches) for text in batch
+        ]
+
+
+def get_dish_text(name: Optional[str], description: Optional[str]) -> str:
+    # NULL is "", like in snapshots, so a dish gets the same text however it was read
+    return f"{name or ''} {description or ''}"
+
+
+def get_recipe_text(name: Optional[str], ingredients: Optional[str]) -> str:
+    return f"{name or ''} {ingredients or ''}"
@@ -0,0 +1,201 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, spmatrix
+from sklearn.preprocessing import normalize
+
+from utils.utils import (
+    RECIPE_INDEX_POSTINGS,
+    RECIPE_INDEX_QUERY_WORDS,
+    SCORING_CHUNK_SIZE,
+    SIMILARITY_THREADS,
+    SIMILARITY_TOP_K,
+)
+
+
+class TopKSimilarities(NamedTuple):
+    # Cosine similarity of every dish to its closest recipe, 0 when it shares no word
+    # with any recipe
+    max_scores: np.ndarray
+    # (dishes, top_k) rows of recipe_vectors closest first, -1 past the recipes that
+    # share a word with the dish
+    recipe_indexes: np.ndarray
+    # (dishes, top_k) similarities of these recipes, 0 where the index is -1
+    scores: np.ndarray
+
+
+class RecipeIndex(NamedTuple):
+    # Normalized recipe vectors, candidates are scored exactly against them
+    recipe_vectors: csr_matrix
+    # (words, recipes) inverted index that only lists, for every word, the
+    # postings_per_word recipes it weighs the most in
+    postings: csr_matrix
+    postings_per_word: int
+
+
+def _rank_rows(matrix: csr_matrix) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Sorts the stored values of every row, highest first. Returns the row, position
+    # in matrix.data and rank within its row of every value in that order
+    row_lengths = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(matrix.shape[0]), row_lengths)
+    order = np.lexsort((-matrix.data, rows))
+    ranks = np.arange(len(order)) - np.repeat(matrix.indptr[:-1], row_lengths)
+    return rows, order, ranks
+
+
+def _keep_row_top_k(matrix: csr_matrix, top_k: int) -> csr_matrix:
+    rows, order, ranks = _rank_rows(matrix)
+    kept = ranks < top_k
+    return csr_matrix(
+        (matrix.data[order][kept], (rows[kept], matrix.indices[order][kept])),
+        shape=matrix.shape,
+    )
+
+
+def _get_block_top_k(similarities: csr_matrix, top_k: int) -> TopKSimilarities:
+    # Keeps the top_k highest stored similarities of every row. Similarities that
+    # aren't stored are 0, no word in common
+    num_rows = similarities.shape[0]
+    rows, order, ranks = _rank_rows(similarities)
+    kept = ranks < top_k
+
+    recipe_indexes = np.full((num_rows, top_k), -1, dtype=np.int32)
+    scores = np.zeros((num_rows, top_k))
+    recipe_indexes[rows[kept], ranks[kept]] = similarities.indices[order][kept]
+    scores[rows[kept], ranks[kept]] = similarities.data[order][kept]
+    return TopKSimilarities(scores[:, 0], recipe_indexes, scores)
+
+
+def _get_empty_top_k(num_dishes: int, top_k: int) -> TopKSimilarities:
+    return TopKSimilarities(
+        np.zeros(num_dishes),
+        np.full((num_dishes, top_k), -1, dtype=np.int32),
+        np.zeros((num_dishes, top_k)),
+    )
+
+
+def _map_blocks(
+    get_block_top_k: Callable[[int], TopKSimilarities],
+    num_dishes: int,
+    chunk_size: int,
+    threads: int,
+) -> TopKSimilarities:
+    # scipy's sparse products and numpy's sorts release the GIL, so blocks run on a
+    # pool of threads
+    starts = range(0, num_dishes, chunk_size)
+    with ThreadPoolExecutor(max(threads, 1)) as executor:
+        blocks = list(executor.map(get_block_top_k, starts))
+    return TopKSimilarities(*(np.concatenate(arrays) for arrays in zip(*blocks)))
+
+
+def get_top_k_similarities(
+    dish_vectors: spmatrix,
+    recipe_vectors: spmatrix,
+    top_k: int = SIMILARITY_TOP_K,
+    chunk_size: int = SCORING_CHUNK_SIZE,
+    threads: int = SIMILARITY_THREADS,
+) -> TopKSimilarities:
+    # Blocks of chunk_size dishes are multiplied with the recipes as sparse matrices,
+    # so only the similarities of dishes and recipes sharing a word are computed and
+    # no dense dishes x recipes matrix ever exists. Only the top_k of every dish are
+    # kept
+    num_dishes = dish_vectors.shape[0]
+    if not num_dishes or not recipe_vectors.shape[0]:
+        return _get_empty_top_k(num_dishes, top_k)
+    dish_vectors = normalize(csr_matrix(dish_vectors))
+    recipe_vectors_t = normalize(csr_matrix(recipe_vectors)).T.tocsr()
+
+    def get_block_top_k(start: int) -> TopKSimilarities:
+        similarities = dish_vectors[start : start + chunk_size] @ recipe_vectors_t
+        return _get_block_top_k(similarities.tocsr(), top_k)
+
+    return _map_blocks(get_block_top_k, num_dishes, chunk_size, threads)
+
+
+def build_recipe_index(
+    recipe_vectors: spmatrix, postings_per_word: int = RECIPE_INDEX_POSTINGS
+) -> RecipeIndex:
+    recipe_vectors = csr_matrix(recipe_vectors)
+    if recipe_vectors.shape[0]:
+        recipe_vectors = normalize(recipe_vectors)
+    postings = _keep_row_top_k(recipe_vectors.T.tocsr(), postings_per_word)
+    return RecipeIndex(recipe_vectors, postings, postings_per_word)
+
+
+def _get_pair_similarities(
+    dish_vectors: csr_matrix,
+    recipe_vectors: csr_matrix,
+    dish_indexes: np.ndarray,
+    recipe_indexes: np.ndarray,
+) -> np.ndarray:
+    # Exact similarity of every (dish, recipe) pair. The dishes are made dense over
+    # only the words they use, and every word of the recipe is looked up there
+    words, word_columns = np.unique(dish_vectors.indices, return_inverse=True)
+    dense_dishes = np.zeros((dish_vectors.shape[0], len(words)))
+    dish_rows = np.repeat(
+        np.arange(dish_vectors.shape[0]), np.diff(dish_vectors.indptr)
+    )
+    dense_dishes[dish_rows, word_columns] = dish_vectors.data
+    word_positions = np.full(recipe_vectors.shape[1], -1)
+    word_positions[words] = np.arange(len(words))
+
+    recipe_lengths = np.diff(recipe_vectors.indptr)[recipe_indexes]
+    starts = np.cumsum(recipe_lengths) - recipe_lengths
+    positions = (
+        np.arange(recipe_lengths.sum())
+        - np.repeat(starts, recipe_lengths)
+        + np.repeat(recipe_vectors.indptr[recipe_indexes], recipe_lengths)
+    )
+    pairs = np.repeat(np.arange(len(recipe_indexes)), recipe_lengths)
+    columns = word_positions[recipe_vectors.indices[positions]]
+    shared = columns >= 0
+    products = (
+        dense_dishes[dish_indexes[pairs[shared]], columns[shared]]
+        * recipe_vectors.data[positions[shared]]
+    )
+    return np.bincount(pairs[shared], weights=products, minlength=len(recipe_indexes))
+
+
+def get_approximate_top_k_similarities(
+    recipe_index: RecipeIndex,
+    dish_vectors: spmatrix,
+    top_k: int = SIMILARITY_TOP_K,
+    query_words: int = RECIPE_INDEX_QUERY_WORDS,
+    chunk_size: int = SCORING_CHUNK_SIZE,
+    threads: int = SIMILARITY_THREADS,
+) -> TopKSimilarities:
+    # Like get_top_k_similarities, but a dish is only compared with the recipes the
+    # index lists under its query_words highest weighted words. That bounds the work
+    # per dish by query_words x postings per word however many recipes there are.
+    # Candidates get their exact similarity, so a dish may miss its closest recipes
+    # but no similarity is overestimated. More query words and postings trade speed
+    # for recall, see benchmarks/recipe_index.py
+    num_dishes = dish_vectors.shape[0]
+    num_recipes = recipe_index.recipe_vectors.shape[0]
+    if not num_dishes or not num_recipes:
+        return _get_empty_top_k(num_dishes, top_k)
+    dish_vectors = normalize(csr_matrix(dish_vectors))
+
+    def get_block_top_k(start: int) -> TopKSimilarities:
+        dishes = dish_vectors[start : start + chunk_size]
+        candidates = (
+            _keep_row_top_k(dishes, query_words) @ recipe_index.postings
+        ).tocsr()
+        dish_indexes = np.repeat(np.arange(dishes.shape[0]), np.diff(candidates.indptr))
+        similarities = _get_pair_similarities(
+            dishes, recipe_index.recipe_vectors, dish_indexes, candidates.indices
+        )
+        shared = similarities > 0
+        return _get_block_top_k(
+            csr_matrix(
+                (
+                    similarities[shared],
+                    (dish_indexes[shared], candidates.indices[shared]),
+                ),
+                shape=(dishes.shape[0], num_recipes),
+            ),
+            top_k,
+        )
+
+    return _map_blocks(get_block_top_k, num_dishes, chunk_size, threads)
@@ -1,19 +1,146 @@
-from typing import List, NamedTuple
+import atexit
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+import numpy.typing as npt
+import ray
 
 from sqlalchemy import (
+    DateTime,
+    Index,
+    event,
     Float,
     ForeignKey,
     create_engine,
     Column,
     Integer,
     String,
+    bindparam,
+    delete,
+    func,
+    or_,
     select,
+    text,
     update,
 )
-from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session as OrmSession, sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import Select
+
+# Can be pointed at a scratch DB, e.g. when replaying a recorded crawl
+DB_URL = os.environ.get("FOODREC_DB_URL", "sqlite:///data/menu.db?timeout=60")
+
+
+class SqliteProfile(NamedTuple):
+    journal_mode: str
+    synchronous: str
+    # Bytes of the DB file that are memory mapped, 0 turns it off
+    mmap_size: int
+    # Page cache per connection
+    cache_size_kib: int
+    # How long a connection waits on a lock before failing with "database is locked"
+    busy_timeout_ms: int
+
+
+SQLITE_PROFILES = {
+    # What SQLite does without any pragmas, readers and the writer block each other
+    "defaults": SqliteProfile("DELETE", "FULL", 0, 2000, 60000),
+    # Readers don't block the writer and the writer doesn't block readers. NORMAL
+    # only syncs at checkpoints, which is safe from corruption in WAL mode
+    "wal": SqliteProfile("WAL", "NORMAL", 256 * 1024**2, 64 * 1024, 60000),
+}
+DB_PROFILE = os.environ.get("FOODREC_DB_PROFILE", "wal")
+# Connections kept open per engine and process
+DB_POOL_SIZE = 5
+
+
+def _apply_sqlite_profile(
+    dbapi_connection, profile: SqliteProfile, read_only: bool
+) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {profile.busy_timeout_ms}")
+    if not read_only:
+        # Persisted in the DB file, so read only connections get it from the writer
+        cursor.execute(f"PRAGMA journal_mode = {profile.journal_mode}")
+    cursor.execute(f"PRAGMA synchronous = {profile.synchronous}")
+    cursor.execute(f"PRAGMA mmap_size = {profile.mmap_size}")
+    # Negative sizes are in KiB rather than pages
+    cursor.execute(f"PRAGMA cache_size = -{profile.cache_size_kib}")
+    if read_only:
+        cursor.execute("PRAGMA query_only = ON")
+    cursor.close()
+
+
+def _begin_sqlite_transactions(engine: Engine) -> None:
+    # pysqlite only emits BEGIN before INSERT/UPDATE/DELETE and never before a
+    # SAVEPOINT, so the first savepoint of a transaction opened it and its RELEASE
+    # committed it. SQLAlchemy's documented workaround: turn off pysqlite's own
+    # transaction handling and emit BEGIN whenever SQLAlchemy begins a transaction
+    event.listen(
+        engine,
+        "connect",
+        lambda dbapi_connection, connection_record: setattr(
+            dbapi_connection, "isolation_level", None
+        ),
+    )
+    event.listen(
+        engine, "begin", lambda connection: connection.exec_driver_sql("BEGIN")
+    )
+
 
-DB_ENGINE = create_engine("sqlite:///data/menu.db?timeout=60", echo=False)
+def create_db_engine(
+    db_url: str, profile: SqliteProfile, read_only: bool = False
+) -> Engine:
+    # The profile is applied to every new connection of a SQLite file DB, connections
+    # are pooled so that only happens once per pooled connection
+    url = make_url(db_url)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(db_url, echo=False)
+    if url.database in (None, "", ":memory:"):
+        engine = create_engine(db_url, echo=False)
+        _begin_sqlite_transactions(engine)
+        return engine
+    engine = create_engine(
+        db_url,
+        echo=False,
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=2 * DB_POOL_SIZE,
+        # Pooled connections are handed to whichever thread checks them out
+        connect_args={"check_same_thread": False},
+    )
+    event.listen(
+        engine,
+        "connect",
+        lambda dbapi_connection, connection_record: _apply_sqlite_profile(
+            dbapi_connection, profile, read_only
+        ),
+    )
+    _begin_sqlite_transactions(engine)
+    return engine
+
+
+DB_ENGINE = create_db_engine(DB_URL, SQLITE_PROFILES[DB_PROFILE])
 Session = sessionmaker(DB_ENGINE)
+# For analytics and the flows' lookups, can't write so it never holds the write lock
+READ_ONLY_DB_ENGINE = create_db_engine(
+    DB_URL, SQLITE_PROFILES[DB_PROFILE], read_only=True
+)
+ReadOnlySession = sessionmaker(READ_ONLY_DB_ENGINE)
+
+DB_WRITER_ACTOR_NAME = "foodrec_db_writer"
+# Pending records that make the DB writer flush before its interval is up
+DB_WRITER_MAX_PENDING = 5000
+DB_WRITER_FLUSH_INTERVAL_SECS = 2.0
+# Rows per chunk yielded by the streaming readers
+DB_READ_CHUNK_SIZE = 10000
 
 
 class CategoryInfo(NamedTuple):
@@ -49,6 +176,10 @@ class Category(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String)
     rel_url = Column(String, unique=True)
+    # When the category's listing page was last crawled and a hash of its restaurants
+    last_crawled_at = Column(DateTime)
+    content_fingerprint = Column(String)
+    __table_args__ = (Index("ix_category_last_crawled_at", "last_crawled_at"),)
 
 
 class Restaurant(Base):
@@ -59,16 +190,56 @@ class Restaurant(Base):
     rel_url = Column(String, unique=True)
     category_id = Column(Integer, ForeignKey("category.id"))
     vegetarian_friendly_score = Column(Float)
+    # When the restaurant's store page was last crawled and a hash of its menu
+    last_crawled_at = Column(DateTime)
+    content_fingerprint = Column(String)
+    # content_fingerprint of the menu vegetarian_friendly_score was computed from
+    scored_fingerprint = Column(String)
+    __table_args__ = (
+        # Restaurants of a category by score, and top restaurants overall
+        Index(
+            "ix_restaurant_category_id_score",
+            "category_id",
+            "vegetarian_friendly_score",
+        ),
+        Index("ix_restaurant_score", "vegetarian_friendly_score"),
+        Index("ix_restaurant_last_crawled_at", "last_crawled_at"),
+    )
 
 
-class Item(Base):
-    __tablename__ = "item"
+class ItemText(Base):
+    # Name and description of a dish, stored once however many restaurants list it,
+    # e.g. every store of a chain
+    __tablename__ = "item_text"
     id = Column(Integer, primary_key=True)
+    content_hash = Column(String, unique=True)
     name = Column(String)
     description = Column(String)
+
+
+class Item(Base):
+    __tablename__ = "item"
+    id = Column(Integer, primary_key=True)
     rel_url = Column(String, unique=True)
     restaurant_id = Column(Integer, ForeignKey("restaurant.id"))
+    item_text_id = Column(Integer, ForeignKey("item_text.id"))
     vegetarian_friendly_score = Column(Float)
+    # item_text_id vegetarian_friendly_score was computed from, it differs from
+    # item_text_id for new items and items whose text changed since
+    scored_item_text_id = Column(Integer)
+    __table_args__ = (
+        # Covers the items and average score per restaurant
+        Index(
+            "ix_item_restaurant_id_score", "restaurant_id", "vegetarian_friendly_score"
+        ),
+        Index("ix_item_item_text_id", "item_text_id"),
+        # Only holds the items that need scoring, see get_unscored_items_query
+        Index(
+            "ix_item_unscored",
+            "id",
+            sqlite_where=text("scored_item_text_id IS NOT item_text_id"),
+        ),
+    )
 
 
 class City(Base):
@@ -84,6 +255,13 @@ class Recipe(Base):
     name = Column(String)
     ingredients = Column(String)
     url = Column(String, unique=True)
+    # When the recipe page was last crawled and a hash of its name and ingredients
+    last_crawled_at = Column(DateTime)
+    content_fingerprint = Column(String)
+    __table_args__ = (
+        # Covers the urls of recently crawled recipes
+        Index("ix_recipe_last_crawled_at_url", "last_crawled_at", "url"),
+    )
 
 
 def create_db_tables() -> None:
@@ -91,65 +269,774 @@ def create_db_tables() -> None:
     Base.metadata.create_all(DB_ENGINE)
 
 
-def save_categories_to_db(categories: List[CategoryInfo]) -> None:
+def get_content_fingerprint(records: List[NamedTuple]) -> str:
+    # Order independent, so a menu or listing that was only reshuffled is unchanged
+    serialized_records = sorted(json.dumps(record) for record in records)
+    return hashlib.sha256("\n".join(serialized_records).encode("utf-8")).hexdigest()
+
+
+def get_item_text_hash(name: Optional[str], description: Optional[str]) -> str:
+    # Whitespace differences between listings of the same dish don't make a new text
+    normalized_text = [
+        " ".join(text.split()) if text else text for text in (name, description)
+    ]
+    return hashlib.sha256(json.dumps(normalized_text).encode("utf-8")).hexdigest()
+
+
+def _get_crawled_before(crawl_ttl: timedelta) -> datetime:
+    return datetime.utcnow() - crawl_ttl
+
+
+class UpsertCounts(NamedTuple):
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    # Rows that were dropped from the source, only items of a menu are deleted
+    deleted: int = 0
+
+    def __add__(self, other: "UpsertCounts") -> "UpsertCounts":
+        return UpsertCounts(*(a + b for a, b in zip(self, other)))
+
+
+# Stays below SQLite's limit of bound parameters in a single statement
+_MAX_IN_VALUES = 500
+
+
+def _upsert_rows(
+    session: OrmSession,
+    model: Base,
+    key_column: str,
+    rows: List[Dict],
+    update_columns: List[str],
+) -> UpsertCounts:
+    # Inserts rows or updates update_columns of the existing row with the same unique
+    # key, in one statement. A conflict never fails the batch, rows with a repeated key
+    # are saved once. Rows are counted as unchanged when none of update_columns other
+    # than last_crawled_at differ from what is stored
+    rows = list({row[key_column]: row for row in rows}.values())
+    if not rows:
+        return UpsertCounts()
+    compared_columns = [
+        column for column in update_columns if column != "last_crawled_at"
+    ]
+    key = getattr(model, key_column)
+    keys = [row[key_column] for row in rows]
+    existing_rows = {}
+    for i in range(0, len(keys), _MAX_IN_VALUES):
+        existing_rows_query = select(
+            key, *(getattr(model, column) for column in compared_columns)
+        ).where(key.in_(keys[i : i + _MAX_IN_VALUES]))
+        for existing_row in session.execute(existing_rows_query):
+            existing_rows[existing_row[0]] = tuple(existing_row[1:])
+
+    inserted = updated = 0
+    for row in rows:
+        existing_row = existing_rows.get(row[key_column])
+        if existing_row is None:
+            inserted += 1
+        elif existing_row != tuple(row[column] for column in compared_columns):
+            updated += 1
+
+    upsert_statement = sqlite_insert(model.__table__)
+    upsert_statement = upsert_statement.on_conflict_do_update(
+        index_elements=[key_column],
+        set_={column: upsert_statement.excluded[column] for column in update_columns},
+    )
+    session.execute(upsert_statement, rows)
+    return UpsertCounts(inserted, updated, len(rows) - inserted - updated)
+
+
+def _save_categories(
+    session: OrmSession, categories: List[CategoryInfo]
+) -> UpsertCounts:
+    return _upsert_rows(
+        session,
+        Category,
+        "rel_url",
+        [category._asdict() for category in categories],
+        ["name"],
+    )
+
+
+def _save_restaurants(
+    session: OrmSession, category_id: int, restaurants: List[RestaurantInfo]
+) -> UpsertCounts:
+    # A restaurant listed in several categories keeps the category it was first
+    # saved under. The category is marked as crawled in the same transaction
+    counts = _upsert_rows(
+        session,
+        Restaurant,
+        "rel_url",
+        [
+            dict(restaurant._asdict(), category_id=category_id)
+            for restaurant in restaurants
+        ],
+        ["name", "rating"],
+    )
+    session.execute(
+        update(Category)
+        .where(Category.id == category_id)
+        .values(
+            last_crawled_at=datetime.utcnow(),
+            content_fingerprint=get_content_fingerprint(restaurants),
+        )
+    )
+    return counts
+
+
+def _save_item_texts(session: OrmSession, items: List[ItemInfo]) -> Dict[str, int]:
+    # Inserts the texts that aren't stored yet, returns content hash -> item_text id
+    # for all of them
+    rows = {}
+    for item in items:
+        content_hash = get_item_text_hash(item.name, item.description)
+        rows[content_hash] = {
+            "content_hash": content_hash,
+            "name": item.name,
+            "description": item.description,
+        }
+    if not rows:
+        return {}
+    session.execute(
+        sqlite_insert(ItemText.__table__).on_conflict_do_nothing(
+            index_elements=["content_hash"]
+        ),
+        list(rows.values()),
+    )
+    content_hashes = list(rows)
+    item_text_ids = {}
+    for i in range(0, len(content_hashes), _MAX_IN_VALUES):
+        item_text_ids_query = select(ItemText.content_hash, ItemText.id).where(
+            ItemText.content_hash.in_(content_hashes[i : i + _MAX_IN_VALUES])
+        )
+        item_text_ids.update(session.execute(item_text_ids_query).all())
+    return item_text_ids
+
+
+def _save_items(
+    session: OrmSession, restaurant_id: int, items: List[ItemInfo]
+) -> UpsertCounts:
+    # Items are upserted so the ones still on the menu keep their scores, items no
+    # longer on it are deleted. A menu with the fingerprint of the last crawl isn't
+    # touched, either way the restaurant is marked as crawled
+    fingerprint = get_content_fingerprint(items)
+    db_restaurant = session.get(Restaurant, restaurant_id)
+    if db_restaurant.content_fingerprint == fingerprint:
+        counts = UpsertCounts(unchanged=len({item.rel_url for item in items}))
+    else:
+        item_text_ids = _save_item_texts(session, items)
+        counts = _upsert_rows(
+            session,
+            Item,
+            "rel_url",
+            [
+                {
+                    "rel_url": item.rel_url,
+                    "restaurant_id": restaurant_id,
+                    "item_text_id": item_text_ids[
+                        get_item_text_hash(item.name, item.description)
+                    ],
+                }
+                for item in items
+            ],
+            ["item_text_id"],
+        )
+        # What's no longer on the menu is found here rather than with a NOT IN of
+        # every rel_url, which would bind one parameter per item
+        rel_urls = {item.rel_url for item in items}
+        deleted_ids = [
+            item_id
+            for item_id, rel_url in session.execute(
+                select(Item.id, Item.rel_url).where(Item.restaurant_id == restaurant_id)
+            )
+            if rel_url not in rel_urls
+        ]
+        for i in range(0, len(deleted_ids), _MAX_IN_VALUES):
+            session.execute(
+                delete(Item)
+                .where(Item.id.in_(deleted_ids[i : i + _MAX_IN_VALUES]))
+                .execution_options(synchronize_session=False)
+            )
+        counts = counts._replace(deleted=len(deleted_ids))
+    db_restaurant.last_crawled_at = datetime.utcnow()
+    db_restaurant.content_fingerprint = fingerprint
+    return counts
+
+
+def _save_recipes(session: OrmSession, recipes: List[RecipeInfo]) -> UpsertCounts:
+    now = datetime.utcnow()
+    return _upsert_rows(
+        session,
+        Recipe,
+        "url",
+        [
+            dict(
+                recipe._asdict(),
+                last_crawled_at=now,
+                content_fingerprint=get_content_fingerprint([recipe]),
+            )
+            for recipe in recipes
+        ],
+        ["name", "ingredients", "last_crawled_at", "content_fingerprint"],
+    )
+
+
+def save_categories_to_db(categories: List[CategoryInfo]) -> UpsertCounts:
     # combining the contexts means commit and close are implicitly called
     with Session() as session, session.begin():
-        db_transformed_categories = [
-            Category(**category._asdict()) for category in categories
-        ]
-        session.add_all(db_transformed_categories)
+        return _save_categories(session, categories)
 
 
 def save_restaurants_to_db(
     category: Category, restaurants: List[RestaurantInfo]
-) -> None:
-    # combining the contexts means commit and close are implicitly called
+) -> UpsertCounts:
     with Session() as session, session.begin():
-        db_transformed_restaurants = [
-            Restaurant(category_id=category.id, **restaurant._asdict())
-            for restaurant in restaurants
-        ]
-        session.add_all(db_transformed_restaurants)
+        return _save_restaurants(session, category.id, restaurants)
 
 
-def save_items_to_db(restaurant: Restaurant, items: List[ItemInfo]) -> None:
+def save_items_to_db(restaurant: Restaurant, items: List[ItemInfo]) -> UpsertCounts:
     with Session() as session, session.begin():
-        db_transformed_items = [
-            Item(restaurant_id=restaurant.id, **item._asdict()) for item in items
-        ]
-        session.add_all(db_transformed_items)
+        return _save_items(session, restaurant.id, items)
+
+
+# DbTable Enum
+class DbTable:
+    CATEGORY = "category"
+    RESTAURANT = "restaurant"
+    ITEM = "item"
+    RECIPE = "recipe"
+
+
+# How a write to each table is saved, restaurants and items also take the id of the
+# category or restaurant they belong to
+_SAVE_FUNCTIONS = {
+    DbTable.CATEGORY: lambda session, parent_id, records: _save_categories(
+        session, records
+    ),
+    DbTable.RESTAURANT: _save_restaurants,
+    DbTable.ITEM: _save_items,
+    DbTable.RECIPE: lambda session, parent_id, records: _save_recipes(session, records),
+}
+
+
+class DbWriter:
+    # The only writer to the DB while a flow runs. Tasks hand it records without
+    # waiting for the DB, it buffers them and writes everything pending in a single
+    # transaction once DB_WRITER_MAX_PENDING records piled up or every
+    # DB_WRITER_FLUSH_INTERVAL_SECS. Each write gets a savepoint, so a write that
+    # fails is reported and skipped without losing the rest of the flush
+    def __init__(
+        self,
+        max_pending: int = DB_WRITER_MAX_PENDING,
+        flush_interval_secs: float = DB_WRITER_FLUSH_INTERVAL_SECS,
+    ):
+        self.max_pending = max_pending
+        self.flush_interval_secs = flush_interval_secs
+        # (table, parent id, records) of every write since the last flush
+        self.pending: List[Tuple[str, Optional[int], List[NamedTuple]]] = []
+        self.pending_records = 0
+        self.lock = threading.Lock()
+        # Flushes only run one at a time, writes can keep coming in meanwhile
+        self.flush_lock = threading.Lock()
+        self.flush_requested = threading.Event()
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def write(
+        self, table: str, records: List[NamedTuple], parent_id: Optional[int] = None
+    ) -> None:
+        with self.lock:
+            self.pending.append((table, parent_id, records))
+            self.pending_records += len(records)
+            if self.pending_records >= self.max_pending:
+                self.flush_requested.set()
+
+    def _flush_periodically(self) -> None:
+        while True:
+            self.flush_requested.wait(self.flush_interval_secs)
+            self.flush_requested.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Could not flush writes to DB, got exception: {e}")
+
+    def flush(self) -> int:
+        # Writes everything pending and returns the number of writes that failed
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending, self.pending_records = self.pending, [], 0
+            if not pending:
+                return 0
+            failed_writes = 0
+            table_counts: Dict[str, UpsertCounts] = {}
+            with Session() as session, session.begin():
+                for table, parent_id, records in pending:
+                    try:
+                        with session.begin_nested():
+                            counts = _SAVE_FUNCTIONS[table](session, parent_id, records)
+                        table_counts[table] = (
+                            table_counts.get(table, UpsertCounts()) + counts
+                        )
+                    except Exception as e:
+                        failed_writes += 1
+                        print(
+                            f"Could not write {len(records)} records to {table} with parent {parent_id}, got exception: {e}"
+                        )
+            for table, counts in table_counts.items():
+                print(
+                    f"Flushed {table}: {counts.inserted} inserted, {counts.updated} updated, {counts.unchanged} unchanged, {counts.deleted} deleted"
+                )
+            return failed_writes
+
+
+# A single named actor is the DB writer, so tasks on every Ray worker never wait on
+# SQLite's lock. Threaded so writes are taken in while a flush runs
+DbWriterActor = ray.remote(num_cpus=0, max_concurrency=4)(DbWriter)
+
+_db_writer = None
+
+
+def get_db_writer():
+    # Returns the shared actor when running on Ray, otherwise a writer local to this
+    # process
+    global _db_writer
+    if _db_writer is None:
+        if ray.is_initialized():
+            _db_writer = DbWriterActor.options(
+                name=DB_WRITER_ACTOR_NAME, get_if_exists=True
+            ).remote()
+        else:
+            _db_writer = DbWriter()
+            atexit.register(_db_writer.flush)
+    return _db_writer
+
+
+def write_to_db(
+    table: str, records: List[NamedTuple], parent_id: Optional[int] = None
+) -> Optional[ray.ObjectRef]:
+    # Hands the records to the DB writer. On Ray the returned ref resolves once the
+    # writer has them, not once they are written
+    db_writer = get_db_writer()
+    if isinstance(db_writer, DbWriter):
+        db_writer.write(table, records, parent_id)
+        return None
+    return db_writer.write.remote(table, records, parent_id)
+
+
+def wait_for_db_writes(write_refs: List[Optional[ray.ObjectRef]]) -> None:
+    # Called at the end of a task so its records reach the writer before it completes
+    ray.get([write_ref for write_ref in write_refs if write_ref is not None])
+
+
+def flush_db_writer() -> None:
+    # Called by the flows before reading what earlier tasks wrote
+    db_writer = get_db_writer()
+    if isinstance(db_writer, DbWriter):
+        db_writer.flush()
+    else:
+        ray.get(db_writer.flush.remote())
+
+
+# The queries run by every crawl and scoring run, their plans are checked by
+# utils/query_plans.py so they keep using the indexes
+
+
+def get_stale_restaurants_query(crawl_ttl: timedelta) -> Select:
+    # Restaurants whose store page was never crawled or not within crawl_ttl
+    return select(Restaurant).where(
+        or_(
+            Restaurant.last_crawled_at.is_(None),
+            Restaurant.last_crawled_at < _get_crawled_before(crawl_ttl),
+        )
+    )
+
+
+def get_stale_categories_query(crawl_ttl: timedelta) -> Select:
+    # Categories whose listing page was never crawled or not within crawl_ttl
+    return select(Category).where(
+        or_(
+            Category.last_crawled_at.is_(None),
+            Category.last_crawled_at < _get_crawled_before(crawl_ttl),
+        )
+    )
+
+
+def get_fresh_recipe_urls_query(crawl_ttl: timedelta) -> Select:
+    # Urls of recipes crawled within crawl_ttl, these don't need to be fetched again
+    return select(Recipe.url).where(
+        Recipe.last_crawled_at >= _get_crawled_before(crawl_ttl)
+    )
+
+
+def get_top_restaurants_query(limit: int) -> Select:
+    return (
+        select(Restaurant)
+        .where(Restaurant.vegetarian_friendly_score.is_not(None))
+        .order_by(Restaurant.vegetarian_friendly_score.desc())
+        .limit(limit)
+    )
+
+
+def get_category_restaurants_query(category_id: int) -> Select:
+    return (
+        select(Restaurant)
+        .where(Restaurant.category_id == category_id)
+        .order_by(Restaurant.vegetarian_friendly_score.desc())
+    )
+
+
+def get_restaurant_items_query(restaurant_id: int) -> Select:
+    return select(Item).where(Item.restaurant_id == restaurant_id)
+
+
+def get_restaurant_item_scores_query() -> Select:
+    # Average score and number of scored items per restaurant
+    return (
+        select(
+            Item.restaurant_id,
+            func.avg(Item.vegetarian_friendly_score),
+            func.count(Item.vegetarian_friendly_score),
+        )
+        .where(Item.restaurant_id.is_not(None))
+        .group_by(Item.restaurant_id)
+    )
 
 
 def get_restaurants_from_db() -> List[Restaurant]:
-    with Session(expire_on_commit=False) as session, session.begin():
+    with ReadOnlySession(expire_on_commit=False) as session, session.begin():
         restaurants_query = select(Restaurant)
         restaurants = session.execute(restaurants_query).scalars().all()
         return restaurants
 
 
+def get_stale_restaurants_from_db(crawl_ttl: timedelta) -> List[Restaurant]:
+    with ReadOnlySession(expire_on_commit=False) as session, session.begin():
+        restaurants_query = get_stale_restaurants_query(crawl_ttl)
+        restaurants = session.execute(restaurants_query).scalars().all()
+        return restaurants
+
+
+def get_top_restaurants_from_db(limit: int) -> List[Restaurant]:
+    with ReadOnlySession(expire_on_commit=False) as session, session.begin():
+        restaurants_query = get_top_restaurants_query(limit)
+        restaurants = session.execute(restaurants_query).scalars().all()
+        return restaurants
+
+
+def get_category_restaurants_from_db(category: Category) -> List[Restaurant]:
+    with ReadOnlySession(expire_on_commit=False) as session, session.begin():
+        restaurants_query = get_category_restaurants_query(category.id)
+        restaurants = session.execute(restaurants_query).scalars().all()
+        return restaurants
+
+
 def get_categories_from_db() -> List[Category]:
-    with Session(expire_on_commit=False) as session, session.begin():
+    with ReadOnlySession(expire_on_commit=False) as session, session.begin():
         categories_query = select(Category)
         categories = session.execute(categories_query).scalars().all()
         return categories
 
 
+def get_stale_categories_from_db(crawl_ttl: timedelta) -> List[Category]:
+    with ReadOnlySession(expire_on_commit=False) as session, session.begin():
+        categories_query = get_stale_categories_query(crawl_ttl)
+        categories = session.execute(categories_query).scalars().all()
+        return categories
+
+
+def get_fresh_recipe_urls_from_db(crawl_ttl: timedelta) -> Set[str]:
+    with ReadOnlySession() as session, session.begin():
+        recipe_urls_query = get_fresh_recipe_urls_query(crawl_ttl)
+        return set(session.execute(recipe_urls_query).scalars())
+
+
 def get_items_from_db() -> List[Item]:
-    with Session(expire_on_commit=False) as session, session.begin():
+    with ReadOnlySession(expire_on_commit=False) as session, session.begin():
         items_query = select(Item)
         items = session.execute(items_query).scalars().all()
         return items
 
 
+def get_restaurant_items_from_db(restaurant: Restaurant) -> List[Item]:
+    with ReadOnlySession(expire_on_commit=False) as session, session.begin():
+        items_query = get_restaurant_items_query(restaurant.id)
+        items = session.execute(items_query).scalars().all()
+        return items
+
+
+def get_restaurant_item_scores_from_db() -> Dict[int, Tuple[float, int]]:
+    # restaurant id -> (average item score, number of scored items)
+    with ReadOnlySession() as session, session.begin():
+        scores_query = get_restaurant_item_scores_query()
+        return {
+            restaurant_id: (average_score, num_items)
+            for restaurant_id, average_score, num_items in session.execute(scores_query)
+        }
+
+
+# Streaming readers select only the columns a consumer needs and yield them in chunks
+# of at most chunk_size rows, so the whole table is never held in memory as ORM
+# instances
+
+
+class IdScores(NamedTuple):
+    ids: np.ndarray
+    # NaN where no score was saved yet
+    scores: np.ndarray
+
+
+def get_item_texts_query() -> Select:
+    return select(
+        Item.id, Item.restaurant_id, ItemText.name, ItemText.description
+    ).outerjoin(ItemText, Item.item_text_id == ItemText.id)
+
+
+def get_unique_item_texts_query() -> Select:
+    # Texts dropped from every menu are left in item_text but skipped here
+    return select(ItemText.id, ItemText.name, ItemText.description).where(
+        select(Item.id).where(Item.item_text_id == ItemText.id).exists()
+    )
+
+
+def get_item_text_ids_query() -> Select:
+    return select(Item.id, Item.item_text_id)
+
+
+def get_recipe_texts_query() -> Select:
+    return select(Recipe.id, Recipe.name, Recipe.ingredients)
+
+
+def get_recipe_ids_query() -> Select:
+    return select(Recipe.id)
+
+
+def get_item_scores_query() -> Select:
+    return select(Item.id, Item.vegetarian_friendly_score)
+
+
+def get_restaurant_scores_query() -> Select:
+    return select(Restaurant.id, Restaurant.vegetarian_friendly_score)
+
+
+def get_unscored_items_query() -> Select:
+    # Items that are new or whose text changed since they were scored. The condition
+    # is the one of ix_item_unscored, so SQLite only reads that partial index
+    return (
+        select(
+            Item.id,
+            Item.restaurant_id,
+            Item.item_text_id,
+            ItemText.name,
+            ItemText.description,
+        )
+        .join(ItemText, Item.item_text_id == ItemText.id)
+        .where(Item.scored_item_text_id.is_distinct_from(Item.item_text_id))
+    )
+
+
+def get_unscored_restaurant_ids_query() -> Select:
+    # Restaurants whose menu changed since they were scored, including menus that
+    # only lost items
+    return select(Restaurant.id).where(
+        Restaurant.scored_fingerprint.is_distinct_from(Restaurant.content_fingerprint)
+    )
+
+
+def iter_query_chunks(
+    query: Select,
+    chunk_size: int = DB_READ_CHUNK_SIZE,
+    session: Optional[OrmSession] = None,
+) -> Iterator[List[Tuple]]:
+    # Pages through query in order of its first column, which must be a primary key.
+    # Every chunk is read in its own short transaction, so a slow consumer never
+    # keeps a snapshot open while a crawl is writing. Given a session, every chunk is
+    # read in its transaction instead, so all of them see the same state
+    id_column = query.selected_columns[0]
+    last_id = None
+    while True:
+        chunk_query = query.order_by(id_column).limit(chunk_size)
+        if last_id is not None:
+            chunk_query = chunk_query.where(id_column > last_id)
+        if session is None:
+            with ReadOnlySession() as chunk_session, chunk_session.begin():
+                rows = [tuple(row) for row in chunk_session.execute(chunk_query)]
+        else:
+            rows = [tuple(row) for row in session.execute(chunk_query)]
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+def _iter_id_scores(query: Select, chunk_size: int) -> Iterator[IdScores]:
+    for rows in iter_query_chunks(query, chunk_size):
+        ids, scores = zip(*rows)
+        yield IdScores(
+            np.array(ids, dtype=np.int64), np.array(scores, dtype=np.float64)
+        )
+
+
+def iter_item_texts_from_db(
+    chunk_size: int = DB_READ_CHUNK_SIZE,
+) -> Iterator[List[Tuple[int, Optional[int], str, str]]]:
+    # (id, restaurant id, name, description) of every item
+    return iter_query_chunks(get_item_texts_query(), chunk_size)
+
+
+def iter_unique_item_texts_from_db(
+    chunk_size: int = DB_READ_CHUNK_SIZE,
+) -> Iterator[List[Tuple[int, str, str]]]:
+    # (item_text id, name, description) of every distinct dish, what scoring needs
+    # to preprocess and vectorize
+    return iter_query_chunks(get_unique_item_texts_query(), chunk_size)
+
+
+def iter_item_text_ids_from_db(
+    chunk_size: int = DB_READ_CHUNK_SIZE,
+) -> Iterator[List[Tuple[int, Optional[int]]]]:
+    # (id, item_text id) of every item, to map scores of texts back to items
+    return iter_query_chunks(get_item_text_ids_query(), chunk_size)
+
+
+def iter_recipe_texts_from_db(
+    chunk_size: int = DB_READ_CHUNK_SIZE,
+) -> Iterator[List[Tuple[int, str, str]]]:
+    # (id, name, ingredients) of every recipe
+    return iter_query_chunks(get_recipe_texts_query(), chunk_size)
+
+
+def iter_item_scores_from_db(
+    chunk_size: int = DB_READ_CHUNK_SIZE,
+) -> Iterator[IdScores]:
+    return _iter_id_scores(get_item_scores_query(), chunk_size)
+
+
+def iter_restaurant_scores_from_db(
+    chunk_size: int = DB_READ_CHUNK_SIZE,
+) -> Iterator[IdScores]:
+    return _iter_id_scores(get_restaurant_scores_query(), chunk_size)
+
+
+def iter_unscored_items_from_db(
+    chunk_size: int = DB_READ_CHUNK_SIZE,
+) -> Iterator[List[Tuple[int, Optional[int], int, str, str]]]:
+    # (id, restaurant id, item_text id, name, description) of every item to score
+    return iter_query_chunks(get_unscored_items_query(), chunk_size)
+
+
+def iter_unscored_restaurant_ids_from_db(
+    chunk_size: int = DB_READ_CHUNK_SIZE,
+) -> Iterator[List[Tuple[int]]]:
+    return iter_query_chunks(get_unscored_restaurant_ids_query(), chunk_size)
+
+
 def populate_item_in_db(item: Item, item_info: ItemInfo) -> None:
     with Session() as session, session.begin():
+        item_text_ids = _save_item_texts(session, [item_info])
         session.execute(
             update(Item)
             .where(Item.id == item.id)
-            .values(name=item_info.name, description=item_info.description)
+            .values(item_text_id=next(iter(item_text_ids.values())))
+        )
+
+
+def save_recipe_to_db(recipe: RecipeInfo) -> UpsertCounts:
+    with Session() as session, session.begin():
+        return _save_recipes(session, [recipe])
+
+
+def _save_scores(
+    session: OrmSession,
+    model: Base,
+    ids: npt.ArrayLike,
+    scores: npt.ArrayLike,
+    columns: Optional[Dict[str, npt.ArrayLike]] = None,
+    values: Optional[Dict] = None,
+) -> int:
+    # One executemany UPDATE by primary key for the whole batch, rather than loading
+    # every row into the session to set its score. Rows are written in id order so
+    # consecutive updates land on the same pages. columns are set per row like the
+    # scores, values are the same for every row. Returns the number of rows updated
+    ids = np.asarray(ids, dtype=np.int64)
+    columns = {
+        "vegetarian_friendly_score": np.asarray(scores, dtype=np.float64),
+        **{name: np.asarray(column) for name, column in (columns or {}).items()},
+    }
+    for column in columns.values():
+        if ids.shape != column.shape:
+            raise ValueError(f"Got {ids.shape} ids but {column.shape} scores")
+    order = np.argsort(ids, kind="stable")
+    names = ["b_id", *columns]
+    rows = [
+        dict(zip(names, row))
+        for row in zip(
+            ids[order].tolist(),
+            *(column[order].tolist() for column in columns.values()),
+        )
+    ]
+    if not rows:
+        return 0
+    table = model.__table__
+    update_statement = (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(
+            **{name: bindparam(name) for name in columns},
+            **(values or {}),
+        )
+    )
+    return session.connection().execute(update_statement, rows).rowcount
+
+
+def save_item_scores_to_db(
+    item_ids: npt.ArrayLike,
+    scores: npt.ArrayLike,
+    item_text_ids: Optional[npt.ArrayLike] = None,
+) -> int:
+    # item_text_ids are the texts the scores were computed from, -1 for none. Items
+    # whose text changed in the meantime keep needing scoring
+    columns = None
+    if item_text_ids is not None:
+        item_text_ids = np.asarray(item_text_ids, dtype=np.int64)
+        columns = {
+            "scored_item_text_id": np.where(item_text_ids >= 0, item_text_ids, None)
+        }
+    with Session() as session, session.begin():
+        return _save_scores(session, Item, item_ids, scores, columns)
+
+
+def save_restaurant_scores_to_db(
+    restaurant_ids: npt.ArrayLike, scores: npt.ArrayLike
+) -> int:
+    with Session() as session, session.begin():
+        return _save_scores(
+            session,
+            Restaurant,
+            restaurant_ids,
+            scores,
+            values={"scored_fingerprint": Restaurant.__table__.c.content_fingerprint},
         )
 
 
-def save_recipe_to_db(recipe: RecipeInfo) -> None:
+def update_restaurant_scores_in_db(restaurant_ids: npt.ArrayLike) -> int:
+    # Recomputes the average item score of only these restaurants in the DB, with
+    # ix_item_restaurant_id_score. Restaurants left without items get no score
+    item_scores = (
+        select(func.avg(Item.vegetarian_friendly_score))
+        .where(Item.restaurant_id == Restaurant.id)
+        .scalar_subquery()
+    )
+    restaurant_ids = np.unique(np.asarray(restaurant_ids, dtype=np.int64)).tolist()
+    num_updated = 0
     with Session() as session, session.begin():
-        session.add(Recipe(**recipe._asdict()))
+        for i in range(0, len(restaurant_ids), _MAX_IN_VALUES):
+            num_updated += session.execute(
+                update(Restaurant)
+                .where(Restaurant.id.in_(restaurant_ids[i : i + _MAX_IN_VALUES]))
+                .values(
+                    vegetarian_friendly_score=item_scores,
+                    scored_fingerprint=Restaurant.content_fingerprint,
+                )
+                .execution_options(synchronize_session=False)
+            ).rowcount
+    return num_updated
@@ -0,0 +1,201 @@
+import json
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from lxml import etree
+
+from utils.db_utils import ItemInfo, RestaurantInfo
+
+LD_JSON_SCRIPT_OPEN_RE = re.compile(
+    r"<script[^>]*type=[\"']application/ld\+json[\"'][^>]*>", re.IGNORECASE
+)
+
+
+def iter_ld_json_payloads(page_text: str) -> Iterator[str]:
+    # Scans the raw html for ld+json script blocks without building a DOM,
+    # script contents are raw text in html so no entity decoding is needed
+    for match in LD_JSON_SCRIPT_OPEN_RE.finditer(page_text):
+        end = page_text.find("</script>", match.end())
+        if end == -1:
+            return
+        yield page_text[match.end() : end]
+
+
+def extract_menu_items(page_text: str, restaurant_id: int) -> List[ItemInfo]:
+    # Walks the first Restaurant ld+json block of an UberEats store page through
+    # hasMenu -> hasMenuSection -> hasMenuItem
+    for payload in iter_ld_json_payloads(page_text):
+        try:
+            ld_json = json.loads(payload)
+        except ValueError:
+            continue
+        if not isinstance(ld_json, dict) or ld_json.get("@type") != "Restaurant":
+            continue
+
+        item_infos = []
+        menu = ld_json.get("hasMenu") or {}
+        for menu_section in menu.get("hasMenuSection") or []:
+            for item in menu_section.get("hasMenuItem") or []:
+                name, description = item.get("name"), item.get("description")
+                # TODO: drop rel_url col fro DB and info
+                dummy_rel_url = f"{name}+{restaurant_id}"
+                item_infos.append(ItemInfo(name, description, dummy_rel_url))
+        return item_infos
+    return []
+
+
+# Listing pages (UberEats categories, search and collection pages) are parsed with
+# an lxml parser target, so libxml2 streams start/end/data events to the callbacks
+# below and no tree is built. Only the elements asked for are kept
+
+
+class _LinksTarget:
+    def __init__(self, href_prefix: str, within_tag: Optional[str]):
+        self.href_prefix = href_prefix
+        self.within_tag = within_tag
+        # None until within_tag is seen, so the caller can tell a page without it apart
+        self.links: Optional[List[Dict[str, str]]] = None if within_tag else []
+        self.within_depth = 0
+
+    def start(self, tag: str, attrib) -> None:
+        if tag == self.within_tag:
+            self.within_depth += 1
+            if self.links is None:
+                self.links = []
+        if tag != "a" or (self.within_tag and not self.within_depth):
+            return
+        href = attrib.get("href")
+        if href and href.startswith(self.href_prefix):
+            self.links.append(dict(attrib))
+
+    def end(self, tag: str) -> None:
+        if tag == self.within_tag:
+            self.within_depth -= 1
+
+    def data(self, data: str) -> None:
+        pass
+
+    def close(self) -> Optional[List[Dict[str, str]]]:
+        return self.links
+
+
+def extract_links(
+    page_text: str, href_prefix: str, within_tag: Optional[str] = None
+) -> Optional[List[Dict[str, str]]]:
+    # Attributes of every <a> whose href starts with href_prefix, in document order.
+    # With within_tag only anchors inside that element count, and None is returned
+    # when the page doesn't have it
+    parser = etree.HTMLParser(target=_LinksTarget(href_prefix, within_tag))
+    parser.feed(page_text)
+    return parser.close()
+
+
+# Texts longer than this without their surrounding whitespace can't be a rating, so
+# they aren't accumulated. Pretty-printed pages indent a rating by more than this
+_MAX_RATING_TEXT_LEN = 32
+
+
+class _OpenElement:
+    __slots__ = ("tag", "href", "position", "first_rated_div", "text_parts", "text_len")
+
+    def __init__(
+        self, tag: str, href: Optional[str], position: int, first_rated_div: int
+    ):
+        self.tag = tag
+        self.href = href
+        self.position = position
+        # Every div closing after this index of rated_divs is a descendant
+        self.first_rated_div = first_rated_div
+        self.text_parts: List[str] = []
+        self.text_len = 0
+
+
+class _RestaurantCardsTarget:
+    # A restaurant card is the parent of an <a href="/store..."> wrapping an <h3> with
+    # the name, the rating is the first div in the card whose whole text is a number.
+    # Ratings are found in the same pass: every div keeps its text while it is short,
+    # divs that close with a numeric text are remembered with their start position and
+    # a card's rating is the earliest starting one among the divs that closed inside it
+    def __init__(self, href_prefix: str, limit: Optional[int]):
+        self.href_prefix = href_prefix
+        self.limit = limit
+        self.stack: List[_OpenElement] = []
+        self.position = 0
+        # (start position, rating) of closed divs, in closing order
+        self.rated_divs: List[Tuple[int, float]] = []
+        # position of an open card -> indexes of its restaurants
+        self.open_cards: Dict[int, List[int]] = {}
+        self.names: List[str] = []
+        self.hrefs: List[str] = []
+        self.ratings: List[float] = []
+        self.name_parts: Optional[List[str]] = None
+
+    def start(self, tag: str, attrib) -> None:
+        self.position += 1
+        parent = self.stack[-1] if self.stack else None
+        if (
+            tag == "h3"
+            and parent is not None
+            and parent.href is not None
+            and parent.href.startswith(self.href_prefix)
+            and len(self.stack) > 1
+            and (self.limit is None or len(self.names) < self.limit)
+        ):
+            card = self.stack[-2]
+            self.open_cards.setdefault(card.position, []).append(len(self.names))
+            self.names.append("")
+            self.hrefs.append(parent.href)
+            self.ratings.append(0)
+            self.name_parts = []
+        self.stack.append(
+            _OpenElement(tag, attrib.get("href"), self.position, len(self.rated_divs))
+        )
+
+    def data(self, data: str) -> None:
+        if self.name_parts is not None:
+            self.name_parts.append(data)
+        for element in reversed(self.stack):
+            if element.tag != "div":
+                continue
+            # Text of a div includes the text of all its descendants
+            if element.text_len <= _MAX_RATING_TEXT_LEN:
+                element.text_parts.append(data)
+                element.text_len += len(data.strip())
+            else:
+                # Its ancestors' texts are at least as long
+                break
+
+    def end(self, tag: str) -> None:
+        if not self.stack:
+            return
+        element = self.stack.pop()
+        if element.tag == "h3" and self.name_parts is not None:
+            self.names[-1] = "".join(self.name_parts)
+            self.name_parts = None
+        if element.tag == "div" and element.text_len <= _MAX_RATING_TEXT_LEN:
+            try:
+                rating = float("".join(element.text_parts))
+                self.rated_divs.append((element.position, rating))
+            except ValueError:
+                pass
+        if element.position in self.open_cards:
+            restaurant_indexes = self.open_cards.pop(element.position)
+            rated_divs = self.rated_divs[element.first_rated_div :]
+            if rated_divs:
+                rating = min(rated_divs)[1]
+                for restaurant_index in restaurant_indexes:
+                    self.ratings[restaurant_index] = rating
+
+    def close(self) -> List[RestaurantInfo]:
+        return [
+            RestaurantInfo(name, rating, href)
+            for name, rating, href in zip(self.names, self.ratings, self.hrefs)
+        ]
+
+
+def extract_restaurant_cards(
+    page_text: str, href_prefix: str = "/store", limit: Optional[int] = None
+) -> List[RestaurantInfo]:
+    parser = etree.HTMLParser(target=_RestaurantCardsTarget(href_prefix, limit))
+    parser.feed(page_text)
+    return parser.close()
@@ -0,0 +1,180 @@
+import asyncio
+import atexit
+import threading
+from typing import Coroutine, Dict, List, NamedTuple, Optional
+
+import aiohttp
+
+from utils.http_cache import get_response_cache
+from utils.rate_limit import wait_for_rate_limit_async
+from utils.replay import HttpMode, get_http_mode, get_response_archive
+from utils.utils import (
+    BASE_HEADERS,
+    FETCH_KEEPALIVE_SECS,
+    FETCH_MAX_CONCURRENCY,
+    FETCH_PER_HOST_LIMIT,
+    HTTP_CACHE_OFFLINE,
+    REQUEST_GET_TIMEOUT_SECS,
+)
+
+
+class FetchResult(NamedTuple):
+    url: str
+    status: Optional[int]
+    text: Optional[str]
+    error: Optional[str]
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.text is not None
+
+
+class HttpClient:
+    # One client is kept alive per worker process. It owns an event loop running in a
+    # background thread so the aiohttp session, and its pool of keep-alive
+    # connections, outlives any single task
+    def __init__(
+        self,
+        max_connections: int = FETCH_MAX_CONCURRENCY,
+        per_host_limit: int = FETCH_PER_HOST_LIMIT,
+        keepalive_secs: float = FETCH_KEEPALIVE_SECS,
+        headers: Dict[str, str] = BASE_HEADERS,
+    ):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.session: aiohttp.ClientSession = self.run(
+            self._create_session(
+                max_connections, per_host_limit, keepalive_secs, headers
+            )
+        )
+
+    async def _create_session(
+        self,
+        max_connections: int,
+        per_host_limit: int,
+        keepalive_secs: float,
+        headers: Dict[str, str],
+    ) -> aiohttp.ClientSession:
+        # The connector caps the number of open connections overall and per host,
+        # requests above the caps wait for a free connection instead of failing
+        connector = aiohttp.TCPConnector(
+            limit=max_connections,
+            limit_per_host=per_host_limit,
+            keepalive_timeout=keepalive_secs,
+        )
+        # No total timeout since time spent waiting for a free connection shouldn't count
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=REQUEST_GET_TIMEOUT_SECS,
+            sock_read=REQUEST_GET_TIMEOUT_SECS,
+        )
+        return aiohttp.ClientSession(
+            connector=connector, timeout=timeout, headers=headers
+        )
+
+    def run(self, coroutine: Coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self) -> None:
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+_http_client: Optional[HttpClient] = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient()
+            atexit.register(_http_client.close)
+        return _http_client
+
+
+async def _fetch_from_network(
+    session: aiohttp.ClientSession, url: str, headers: Optional[Dict[str, str]]
+) -> FetchResult:
+    try:
+        response_cache = get_response_cache()
+        cached_response = None
+        if response_cache is not None:
+            cached_response = await asyncio.to_thread(response_cache.get, url)
+            if cached_response is not None and (
+                HTTP_CACHE_OFFLINE or response_cache.is_fresh(cached_response)
+            ):
+                return FetchResult(url, 200, cached_response.text, None)
+        if HTTP_CACHE_OFFLINE:
+            return FetchResult(url, None, None, "Not in the response cache")
+
+        request_headers = dict(headers or {})
+        if cached_response is not None:
+            # Stale entries are revalidated so an unchanged page comes back as a bodyless 304
+            if cached_response.etag:
+                request_headers["If-None-Match"] = cached_response.etag
+            if cached_response.last_modified:
+                request_headers["If-Modified-Since"] = cached_response.last_modified
+
+        await wait_for_rate_limit_async(url)
+        async with session.get(url, headers=request_headers) as response:
+            if response.status == 304 and cached_response is not None:
+                await asyncio.to_thread(response_cache.touch, url)
+                return FetchResult(url, 200, cached_response.text, None)
+            text = await response.text(errors="replace")
+            if response.status == 200 and response_cache is not None:
+                await asyncio.to_thread(
+                    response_cache.put,
+                    url,
+                    text,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                )
+            return FetchResult(url, response.status, text, None)
+    except Exception as e:
+        # Failures are returned instead of raised so one bad page doesn't cancel the batch
+        return FetchResult(url, None, None, f"{type(e).__name__}: {e}")
+
+
+async def _fetch_one(
+    session: aiohttp.ClientSession, url: str, headers: Optional[Dict[str, str]]
+) -> FetchResult:
+    http_mode = get_http_mode()
+    response_archive = get_response_archive()
+    if http_mode == HttpMode.REPLAY:
+        archived_response = await asyncio.to_thread(response_archive.replay, url)
+        if archived_response is None:
+            return FetchResult(url, None, None, "Not in the replay archive")
+        status, text = archived_response
+        return FetchResult(url, status, text, None)
+
+    result = await _fetch_from_network(session, url, headers)
+    if http_mode == HttpMode.RECORD and result.status is not None:
+        await asyncio.to_thread(
+            response_archive.record, url, result.status, result.text
+        )
+    return result
+
+
+async def fetch_all_async(
+    session: aiohttp.ClientSession,
+    urls: List[str],
+    headers: Optional[Dict[str, str]] = None,
+) -> List[FetchResult]:
+    return await asyncio.gather(*(_fetch_one(session, url, headers) for url in urls))
+
+
+def fetch_all(
+    urls: List[str], headers: Optional[Dict[str, str]] = None
+) -> List[FetchResult]:
+    # Results are in the same order as urls, headers are merged over BASE_HEADERS
+    if not urls:
+        return []
+    http_client = get_http_client()
+    return http_client.run(fetch_all_async(http_client.session, urls, headers))
+
+
+def fetch_page(url: str, headers: Optional[Dict[str, str]] = None) -> FetchResult:
+    return fetch_all([url], headers)[0]
@@ -0,0 +1,165 @@
+from collections import deque
+import os
+import shutil
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from persistqueue import Empty, UniqueAckQ
+from persistqueue.serializers import json as json_serializer
+
+from utils.utils import CRAWL_FRONTIER_MAX_ATTEMPTS
+
+
+# CrawlStage Enum
+class CrawlStage:
+    # City pages listing categories
+    CITY = "city"
+    # Category pages listing restaurants
+    CATEGORY = "category"
+    # Store pages with a restaurant's menu
+    STORE = "store"
+    # Recipe pages, including allrecipes collection pages listing more recipes
+    RECIPE = "recipe"
+
+
+class FrontierEntry(NamedTuple):
+    stage: str
+    url: str
+    # DB id and name of the entity the page is crawled for, if it has one
+    entity_id: Optional[int] = None
+    name: Optional[str] = None
+    # Earlier runs whose task failed on the page
+    attempts: int = 0
+
+
+def _get_queue_item(entry: FrontierEntry) -> dict:
+    # A first attempt is stored without attempts, so seeds put again by later runs
+    # match it and frontiers written before attempts were counted
+    item = entry._asdict()
+    if not entry.attempts:
+        del item["attempts"]
+    return item
+
+
+class CrawlFrontier:
+    # Pending work of a flow run, one persist-queue table per stage in a sqlite file
+    # under path. Entries are unique per stage for the whole run, whatever their
+    # status, so work that was already done is never queued again. Only the driver
+    # uses the frontier: it pulls batches for tasks and acks them once the task
+    # completed. Entries pulled but not acked when a run died are put back on the
+    # queue when the frontier is opened again, so the next run resumes from there.
+    # Entries of a failed task are retried by later runs up to
+    # CRAWL_FRONTIER_MAX_ATTEMPTS times, then given up on
+    def __init__(self, path: str):
+        self.path = path
+        self.queues: Dict[str, UniqueAckQ] = {}
+        # stage -> entry -> raw queue item, of the entries pulled and not acked yet
+        self.pulled: Dict[str, Dict[FrontierEntry, dict]] = {}
+
+    def _get_queue(self, stage: str) -> UniqueAckQ:
+        if stage not in self.queues:
+            self.queues[stage] = UniqueAckQ(
+                self.path,
+                name=stage,
+                multithreading=True,
+                serializer=json_serializer,
+                auto_resume=True,
+            )
+            self.pulled[stage] = {}
+        return self.queues[stage]
+
+    def put(self, entries: List[FrontierEntry]) -> int:
+        # Returns how many entries were new
+        new_entries = 0
+        for entry in entries:
+            if self._get_queue(entry.stage).put(_get_queue_item(entry)) is not None:
+                new_entries += 1
+        return new_entries
+
+    def pull(self, stage: str, max_entries: int) -> List[FrontierEntry]:
+        queue = self._get_queue(stage)
+        entries = []
+        while len(entries) < max_entries:
+            try:
+                item = queue.get(block=False, raw=True)
+            except Empty:
+                break
+            entry = FrontierEntry(**item["data"])
+            self.pulled[stage][entry] = item
+            entries.append(entry)
+        return entries
+
+    def ack(self, entries: List[FrontierEntry]) -> None:
+        for entry in entries:
+            self._get_queue(entry.stage).ack(self.pulled[entry.stage].pop(entry))
+
+    def fail(self, entries: List[FrontierEntry]) -> List[FrontierEntry]:
+        # Gives up on the entries of a failed task, and returns the ones to put back
+        # for another attempt. They differ from the failed entries by their attempts,
+        # so they can be queued while the failed ones keep dropping repeated seeds
+        retries = []
+        for entry in entries:
+            self._get_queue(entry.stage).ack_failed(self.pulled[entry.stage].pop(entry))
+            if entry.attempts + 1 < CRAWL_FRONTIER_MAX_ATTEMPTS:
+                retries.append(entry._replace(attempts=entry.attempts + 1))
+        return retries
+
+    def pending(self, stage: str) -> int:
+        # Entries not done yet, including the ones pulled by this run. qsize counts
+        # every entry not pulled, whether it was just put or put back by a resume,
+        # ready_count would only count the latter
+        queue = self._get_queue(stage)
+        return queue.qsize() + queue.unack_count()
+
+    def clear(self) -> None:
+        # Forgets the run, the next one starts from its seeds again
+        self.queues, self.pulled = {}, {}
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def drain_stage(
+    frontier: CrawlFrontier,
+    stage: str,
+    submit_batch: Callable,
+    batch_size: int,
+    get_new_entries: Optional[Callable[[Any], List[FrontierEntry]]] = None,
+) -> None:
+    # Submits every entry of stage in batches through submit_batch, which returns a
+    # prefect future, and acks a batch once its task completed. get_new_entries turns
+    # a task's result into entries found by it, they are queued before the batch is
+    # acked and submitted right away when they belong to this stage. Entries of failed
+    # tasks are put back once the stage is drained, so they are retried by the next
+    # run rather than this one
+    submitted = deque()
+    retries = []
+
+    def submit_pending() -> None:
+        entries = frontier.pull(stage, batch_size)
+        while entries:
+            submitted.append((entries, submit_batch(entries)))
+            entries = frontier.pull(stage, batch_size)
+
+    submit_pending()
+    print(f"Submitted {len(submitted)} batches of {stage} pages")
+    while submitted:
+        entries, future = submitted.popleft()
+        state = future.wait()
+        if not state.is_completed():
+            batch_retries = frontier.fail(entries)
+            retries.extend(batch_retries)
+            print(
+                f"Batch of {len(entries)} {stage} pages did not complete, "
+                f"{len(batch_retries)} will be retried by the next run: {state.message}"
+            )
+            continue
+        if get_new_entries is not None:
+            new_entries = frontier.put(get_new_entries(future.result()))
+            if new_entries:
+                print(f"Batch of {len(entries)} {stage} pages found {new_entries} new")
+        frontier.ack(entries)
+        submit_pending()
+    frontier.put(retries)
+
+
+def get_crawl_frontier(frontier_dir: str, flow_name: str) -> CrawlFrontier:
+    os.makedirs(frontier_dir, exist_ok=True)
+    return CrawlFrontier(os.path.join(frontier_dir, flow_name))
@@ -0,0 +1,198 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from utils.utils import (
+    DEFAULT_HTTP_CACHE_TTL_SECS,
+    HTTP_CACHE_DIR,
+    HTTP_CACHE_ENABLED,
+    HTTP_CACHE_MAX_BYTES,
+    HTTP_CACHE_TTL_SECS,
+    normalize_url,
+)
+
+
+class CachedResponse(NamedTuple):
+    url: str
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+class ResponseCache:
+    # Bodies are stored once per content hash under blobs/, the sqlite index maps
+    # normalized urls to a body plus its validators. Several urls with the same body,
+    # e.g. identical error pages, share one blob
+    def __init__(
+        self, cache_dir: str = HTTP_CACHE_DIR, max_bytes: int = HTTP_CACHE_MAX_BYTES
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(cache_dir, "blobs"), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS response (
+                    url_key TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_response_accessed_at ON response (accessed_at)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_response_content_hash ON response (content_hash)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS blob (content_hash TEXT PRIMARY KEY, size INTEGER NOT NULL)"
+            )
+            # Running total of blob sizes, updated with every blob row so a put never
+            # sums the whole table. Caches written before it get it from the blobs
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO meta SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM blob"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Each call gets its own connection since the cache is used from several
+        # threads and processes at once, sqlite does the locking between them
+        return sqlite3.connect(os.path.join(self.cache_dir, "index.db"), timeout=60)
+
+    def _get_blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, "blobs", content_hash[:2], content_hash)
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        url_key = normalize_url(url)
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT content_hash, etag, last_modified, fetched_at FROM response WHERE url_key = ?",
+                (url_key,),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE response SET accessed_at = ? WHERE url_key = ?",
+                (time.time(), url_key),
+            )
+        content_hash, etag, last_modified, fetched_at = row
+        try:
+            with open(self._get_blob_path(content_hash), "rb") as f:
+                text = zlib.decompress(f.read()).decode("utf-8")
+        except (OSError, zlib.error):
+            # The blob was evicted by another process between the lookup and the read
+            return None
+        return CachedResponse(url, text, etag, last_modified, fetched_at)
+
+    def put(
+        self,
+        url: str,
+        text: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        body = text.encode("utf-8")
+        content_hash = hashlib.sha256(body).hexdigest()
+        blob_path = self._get_blob_path(content_hash)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            # Written to a temporary file first so readers never see a partial blob
+            tmp_path = f"{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(body))
+            os.replace(tmp_path, blob_path)
+
+        now = time.time()
+        size = os.path.getsize(blob_path)
+        with self._connect() as connection:
+            inserted = connection.execute(
+                "INSERT OR IGNORE INTO blob (content_hash, size) VALUES (?, ?)",
+                (content_hash, size),
+            ).rowcount
+            if inserted:
+                connection.execute(
+                    "UPDATE meta SET value = value + ? WHERE key = 'total_bytes'",
+                    (size,),
+                )
+            connection.execute(
+                "INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), content_hash, etag, last_modified, now, now),
+            )
+            self._evict(connection)
+
+    def touch(self, url: str) -> None:
+        # A 304 means the cached body is still current, so it is fresh again
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE response SET fetched_at = ?, accessed_at = ? WHERE url_key = ?",
+                (now, now, normalize_url(url)),
+            )
+
+    def is_fresh(self, cached_response: CachedResponse) -> bool:
+        host = urlsplit(cached_response.url).netloc.lower()
+        ttl_secs = HTTP_CACHE_TTL_SECS.get(host, DEFAULT_HTTP_CACHE_TTL_SECS)
+        return time.time() - cached_response.fetched_at < ttl_secs
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        # Drops the least recently used urls until the blobs fit in max_bytes, in the
+        # transaction of the put that went over it
+        (total_bytes,) = connection.execute(
+            "SELECT value FROM meta WHERE key = 'total_bytes'"
+        ).fetchone()
+        if total_bytes <= self.max_bytes:
+            return
+        lru_rows = connection.execute(
+            "SELECT url_key, content_hash FROM response ORDER BY accessed_at"
+        )
+        evicted_bytes = 0
+        for url_key, content_hash in lru_rows.fetchall():
+            if total_bytes - evicted_bytes <= self.max_bytes:
+                break
+            connection.execute("DELETE FROM response WHERE url_key = ?", (url_key,))
+            (references,) = connection.execute(
+                "SELECT COUNT(*) FROM response WHERE content_hash = ?",
+                (content_hash,),
+            ).fetchone()
+            if references:
+                continue
+            (size,) = connection.execute(
+                "SELECT size FROM blob WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            connection.execute(
+                "DELETE FROM blob WHERE content_hash = ?", (content_hash,)
+            )
+            try:
+                os.remove(self._get_blob_path(content_hash))
+            except OSError:
+                pass
+            evicted_bytes += size
+        connection.execute(
+            "UPDATE meta SET value = value - ? WHERE key = 'total_bytes'",
+            (evicted_bytes,),
+        )
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    global _response_cache
+    if not HTTP_CACHE_ENABLED:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
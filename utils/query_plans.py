@@ -0,0 +1,64 @@
+import re
+from datetime import timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+
+from utils.db_utils import (
+    Base,
+    get_category_restaurants_query,
+    get_fresh_recipe_urls_query,
+    get_restaurant_item_scores_query,
+    get_restaurant_items_query,
+    get_stale_categories_query,
+    get_stale_restaurants_query,
+    get_top_restaurants_query,
+    get_unscored_items_query,
+)
+
+CORE_QUERIES: Dict[str, Select] = {
+    "stale categories": get_stale_categories_query(timedelta(hours=24)),
+    "stale restaurants": get_stale_restaurants_query(timedelta(hours=24)),
+    "fresh recipe urls": get_fresh_recipe_urls_query(timedelta(days=30)),
+    "top restaurants": get_top_restaurants_query(20),
+    "category restaurants": get_category_restaurants_query(1),
+    "restaurant items": get_restaurant_items_query(1),
+    "restaurant item scores": get_restaurant_item_scores_query(),
+    "unscored items": get_unscored_items_query(),
+}
+
+# A plan line reading a whole table row by row, "SCAN item USING INDEX ..." walks an
+# index instead and SEARCH only visits the matching rows
+FULL_TABLE_SCAN_RE = re.compile(r"^SCAN (TABLE )?\w+$")
+
+
+class QueryPlan(NamedTuple):
+    name: str
+    plan: List[str]
+    full_table_scans: List[str]
+
+
+def explain_query_plan(engine: Engine, name: str, query: Select) -> QueryPlan:
+    compiled_query = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled_query}"))
+        plan = [row[-1] for row in rows]
+    return QueryPlan(
+        name, plan, [line for line in plan if FULL_TABLE_SCAN_RE.match(line)]
+    )
+
+
+def check_query_plans(db_url: Optional[str] = None) -> List[QueryPlan]:
+    # Explains the core queries on db_url, by default on an empty in memory DB with
+    # the schema of the models. Pointed at a real DB it also catches a migration
+    # that wasn't applied, and after ANALYZE uses the same statistics as the flows
+    if db_url is None:
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+    else:
+        engine = create_engine(db_url)
+    return [
+        explain_query_plan(engine, name, query) for name, query in CORE_QUERIES.items()
+    ]
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import ray
+
+from utils.utils import DEFAULT_RATE_LIMIT, HOST_RATE_LIMITS
+
+RATE_LIMITER_ACTOR_NAME = "foodrec_rate_limiter"
+
+
+class TokenBucket:
+    def __init__(self, requests_per_sec: float, burst: int):
+        self.requests_per_sec = requests_per_sec
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def reserve(self) -> float:
+        # Takes a token and returns how many seconds to wait before using it.
+        # Tokens can go negative so concurrent callers queue up behind each other
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated_at) * self.requests_per_sec
+        )
+        self.updated_at = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.requests_per_sec
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        host_rate_limits: Dict[str, Tuple[float, int]] = HOST_RATE_LIMITS,
+        default_rate_limit: Tuple[float, int] = DEFAULT_RATE_LIMIT,
+    ):
+        self.host_rate_limits = host_rate_limits
+        self.default_rate_limit = default_rate_limit
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def reserve(self, host: str) -> float:
+        with self.lock:
+            if host not in self.buckets:
+                requests_per_sec, burst = self.host_rate_limits.get(
+                    host, self.default_rate_limit
+                )
+                self.buckets[host] = TokenBucket(requests_per_sec, burst)
+            return self.buckets[host].reserve()
+
+
+# A single named actor holds the buckets so every Ray worker draws from the same budget
+RateLimiterActor = ray.remote(num_cpus=0)(RateLimiter)
+
+_rate_limiter = None
+
+
+def get_rate_limiter():
+    # Returns the shared actor when running on Ray, otherwise a limiter local to this process
+    global _rate_limiter
+    if _rate_limiter is None:
+        if ray.is_initialized():
+            _rate_limiter = RateLimiterActor.options(
+                name=RATE_LIMITER_ACTOR_NAME, get_if_exists=True
+            ).remote()
+        else:
+            _rate_limiter = RateLimiter()
+    return _rate_limiter
+
+
+def _get_host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+async def wait_for_rate_limit_async(url: str) -> None:
+    rate_limiter = get_rate_limiter()
+    if isinstance(rate_limiter, RateLimiter):
+        delay = rate_limiter.reserve(_get_host(url))
+    else:
+        # ObjectRefs can be awaited directly so the event loop isn't blocked
+        delay = await rate_limiter.reserve.remote(_get_host(url))
+    if delay > 0:
+        await asyncio.sleep(delay)
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+from utils.utils import normalize_url
+
+HTTP_MODE_ENV_VAR = "FOODREC_HTTP_MODE"
+HTTP_ARCHIVE_ENV_VAR = "FOODREC_HTTP_ARCHIVE"
+DEFAULT_HTTP_ARCHIVE_PATH = "data/http_archive.db"
+
+
+# HttpMode Enum
+class HttpMode:
+    # Fetches from the network (or the response cache)
+    LIVE = "live"
+    # Same as LIVE, but every response is also written to the archive
+    RECORD = "record"
+    # Serves responses from the archive only, without rate limiting or network access
+    REPLAY = "replay"
+
+
+def get_http_mode() -> str:
+    # Read on every call rather than at import so Main can switch modes before a flow
+    # starts, Ray workers inherit the environment of the driver
+    return os.environ.get(HTTP_MODE_ENV_VAR, HttpMode.LIVE)
+
+
+class ResponseArchive:
+    # A single sqlite file with one zlib compressed row per normalized url, so an
+    # archive can be copied around and looked up without reading it all
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS page (
+                    url_key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    status INTEGER NOT NULL,
+                    body BLOB NOT NULL,
+                    recorded_at REAL NOT NULL
+                )"""
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def record(self, url: str, status: int, text: str) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO page VALUES (?, ?, ?, ?, ?)",
+                (
+                    normalize_url(url),
+                    url,
+                    status,
+                    zlib.compress(text.encode("utf-8")),
+                    time.time(),
+                ),
+            )
+
+    def replay(self, url: str) -> Optional[Tuple[int, str]]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT status, body FROM page WHERE url_key = ?", (normalize_url(url),)
+            ).fetchone()
+        if row is None:
+            return None
+        status, body = row
+        return status, zlib.decompress(body).decode("utf-8")
+
+    def find_urls(self, url_pattern: str, limit: int) -> List[str]:
+        # Urls of successfully archived pages containing url_pattern
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT url FROM page WHERE status = 200 AND instr(url, ?) > 0 LIMIT ?",
+                (url_pattern, limit),
+            ).fetchall()
+        return [url for (url,) in rows]
+
+    def __len__(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM page").fetchone()[0]
+
+
+_response_archives = {}
+_response_archives_lock = threading.Lock()
+
+
+def get_response_archive() -> Optional[ResponseArchive]:
+    if get_http_mode() == HttpMode.LIVE:
+        return None
+    path = os.environ.get(HTTP_ARCHIVE_ENV_VAR, DEFAULT_HTTP_ARCHIVE_PATH)
+    with _response_archives_lock:
+        if path not in _response_archives:
+            _response_archives[path] = ResponseArchive(path)
+        return _response_archives[path]
@@ -0,0 +1,357 @@
+from datetime import datetime
+import json
+import os
+import shutil
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from utils.db_utils import (
+    DB_READ_CHUNK_SIZE,
+    Category,
+    Item,
+    Recipe,
+    Restaurant,
+    ReadOnlySession,
+    get_unique_item_texts_query,
+    iter_query_chunks,
+)
+from utils.utils import SNAPSHOT_DIR
+
+# Bumped whenever the layout of a snapshot changes, older snapshots can't be loaded
+SNAPSHOT_FORMAT_VERSION = 2
+# Text file in the snapshot dir with the version of the newest complete snapshot
+LATEST_SNAPSHOT_FILE = "LATEST"
+MANIFEST_FILE = "manifest.json"
+# Snapshots kept by an export, older ones are removed
+SNAPSHOTS_TO_KEEP = 3
+
+
+# ColumnKind Enum
+class ColumnKind:
+    # A single .npy array, NULL is -1 in integer columns and NaN in float columns
+    NUMERIC = "numeric"
+    # Utf-8 bytes of all values back to back plus their offsets, NULL is ""
+    STRING = "string"
+    # int32 codes into the categories listed in the manifest, NULL is -1
+    CATEGORICAL = "categorical"
+
+
+class SnapshotColumn(NamedTuple):
+    name: str
+    kind: str
+    dtype: Optional[str] = None
+    # Derives the column from the value of the selected column at the same position
+    transform: Optional[Callable[[Any], Any]] = None
+
+
+def get_city_from_category_url(category_rel_url: str) -> str:
+    # ex category_rel_url: /category/emeryville-ca/african
+    return category_rel_url.split("/", 3)[2].rsplit("-", 1)[0].title()
+
+
+# table -> query and the column each selected column is stored as. Ids are int32,
+# which is plenty for a menu DB and halves what the scorer maps
+SNAPSHOT_TABLES: Dict[str, Tuple[Select, List[SnapshotColumn]]] = {
+    "category": (
+        select(Category.id, Category.name, Category.rel_url, Category.rel_url),
+        [
+            SnapshotColumn("id", ColumnKind.NUMERIC, "int32"),
+            SnapshotColumn("name", ColumnKind.CATEGORICAL),
+            SnapshotColumn("rel_url", ColumnKind.STRING),
+            SnapshotColumn(
+                "city", ColumnKind.CATEGORICAL, transform=get_city_from_category_url
+            ),
+        ],
+    ),
+    "restaurant": (
+        select(
+            Restaurant.id,
+            Restaurant.category_id,
+            Restaurant.name,
+            Restaurant.rating,
+            Restaurant.vegetarian_friendly_score,
+            Restaurant.rel_url,
+        ),
+        [
+            SnapshotColumn("id", ColumnKind.NUMERIC, "int32"),
+            SnapshotColumn("category_id", ColumnKind.NUMERIC, "int32"),
+            SnapshotColumn("name", ColumnKind.STRING),
+            SnapshotColumn("rating", ColumnKind.NUMERIC, "float32"),
+            SnapshotColumn("vegetarian_friendly_score", ColumnKind.NUMERIC, "float32"),
+            SnapshotColumn("rel_url", ColumnKind.STRING),
+        ],
+    ),
+    "item": (
+        select(
+            Item.id,
+            Item.restaurant_id,
+            Item.item_text_id,
+            Item.vegetarian_friendly_score,
+        ),
+        [
+            SnapshotColumn("id", ColumnKind.NUMERIC, "int32"),
+            SnapshotColumn("restaurant_id", ColumnKind.NUMERIC, "int32"),
+            SnapshotColumn("item_text_id", ColumnKind.NUMERIC, "int32"),
+            SnapshotColumn("vegetarian_friendly_score", ColumnKind.NUMERIC, "float32"),
+        ],
+    ),
+    "item_text": (
+        get_unique_item_texts_query(),
+        [
+            SnapshotColumn("id", ColumnKind.NUMERIC, "int32"),
+            SnapshotColumn("name", ColumnKind.STRING),
+            SnapshotColumn("description", ColumnKind.STRING),
+        ],
+    ),
+    "recipe": (
+        select(Recipe.id, Recipe.name, Recipe.ingredients),
+        [
+            SnapshotColumn("id", ColumnKind.NUMERIC, "int32"),
+            SnapshotColumn("name", ColumnKind.STRING),
+            SnapshotColumn("ingredients", ColumnKind.STRING),
+        ],
+    ),
+}
+
+
+class StringColumn:
+    # Value i is data[offsets[i]:offsets[i + 1]] decoded, both arrays are memory
+    # mapped so only the strings that are read are paged in
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[index] for index in range(len(self)))
+
+    def tolist(self) -> List[str]:
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [
+            data[start:end].decode("utf-8")
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def to_pandas(self) -> List[str]:
+        return self.tolist()
+
+
+class CategoricalColumn(NamedTuple):
+    codes: np.ndarray
+    categories: List[str]
+
+    def to_pandas(self) -> pd.Categorical:
+        return pd.Categorical.from_codes(self.codes, self.categories)
+
+
+class Snapshot(NamedTuple):
+    version: str
+    path: str
+    # table -> column -> np.ndarray, StringColumn or CategoricalColumn
+    tables: Dict[str, Dict[str, Any]]
+
+    def to_dataframe(self, table: str) -> pd.DataFrame:
+        # Numeric columns keep their compact dtypes, strings are decoded
+        return pd.DataFrame(
+            {
+                name: column.to_pandas()
+                if isinstance(column, (StringColumn, CategoricalColumn))
+                else column
+                for name, column in self.tables[table].items()
+            }
+        )
+
+
+def _get_column_path(table_path: str, column: str, part: str) -> str:
+    return os.path.join(table_path, f"{column}.{part}.npy")
+
+
+def _export_table(
+    session: Session,
+    table_path: str,
+    query: Select,
+    columns: List[SnapshotColumn],
+    chunk_size: int,
+) -> Dict[str, Any]:
+    # Reads the table chunk by chunk and keeps only the compact column buffers
+    column_parts = {column.name: [] for column in columns}
+    string_lengths = {column.name: [] for column in columns}
+    category_codes: Dict[str, Dict[str, int]] = {column.name: {} for column in columns}
+    num_rows = 0
+    for rows in iter_query_chunks(query, chunk_size, session):
+        num_rows += len(rows)
+        for position, column in enumerate(columns):
+            values = [row[position] for row in rows]
+            if column.transform is not None:
+                values = [
+                    None if value is None else column.transform(value)
+                    for value in values
+                ]
+            if column.kind == ColumnKind.NUMERIC:
+                null = np.nan if np.dtype(column.dtype).kind == "f" else -1
+                column_parts[column.name].append(
+                    np.array(
+                        [null if value is None else value for value in values],
+                        dtype=column.dtype,
+                    )
+                )
+            elif column.kind == ColumnKind.STRING:
+                encoded = [(value or "").encode("utf-8") for value in values]
+                string_lengths[column.name].append([len(value) for value in encoded])
+                column_parts[column.name].append(
+                    np.frombuffer(b"".join(encoded), dtype=np.uint8)
+                )
+            else:
+                codes = category_codes[column.name]
+                column_parts[column.name].append(
+                    np.array(
+                        [
+                            -1 if value is None else codes.setdefault(value, len(codes))
+                            for value in values
+                        ],
+                        dtype=np.int32,
+                    )
+                )
+
+    os.makedirs(table_path)
+    manifest_columns = {}
+    for column in columns:
+        parts = column_parts[column.name]
+        if column.kind == ColumnKind.NUMERIC:
+            dtype = np.dtype(column.dtype)
+        else:
+            dtype = np.dtype(np.uint8 if column.kind == ColumnKind.STRING else np.int32)
+        values = np.concatenate(parts) if parts else np.array([], dtype=dtype)
+        if column.kind == ColumnKind.STRING:
+            lengths = [
+                length for part in string_lengths[column.name] for length in part
+            ]
+            offsets = np.zeros(num_rows + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            np.save(_get_column_path(table_path, column.name, "offsets"), offsets)
+            np.save(_get_column_path(table_path, column.name, "data"), values)
+        else:
+            np.save(_get_column_path(table_path, column.name, "values"), values)
+        manifest_columns[column.name] = {"kind": column.kind, "dtype": str(dtype)}
+        if column.kind == ColumnKind.CATEGORICAL:
+            manifest_columns[column.name]["categories"] = list(
+                category_codes[column.name]
+            )
+    return {"rows": num_rows, "columns": manifest_columns}
+
+
+def get_id_indexes(sorted_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    # Position of every id in a snapshot's sorted id column, e.g. of every item's
+    # item_text_id in item_text's ids
+    indexes = np.searchsorted(sorted_ids, ids)
+    found = indexes < len(sorted_ids)
+    found[found] = sorted_ids[indexes[found]] == ids[found]
+    if not found.all():
+        raise ValueError(
+            f"{(~found).sum()} of {len(ids)} ids are missing from the snapshot, "
+            f"e.g. {ids[~found][0]}. Export a new one"
+        )
+    return indexes
+
+
+def publish_version(
+    base_dir: str, tmp_path: str, version: str, versions_to_keep: int
+) -> None:
+    # Moves a completely written version into place, points LATEST at it and removes
+    # all but the newest versions_to_keep
+    os.rename(tmp_path, os.path.join(base_dir, version))
+    latest_tmp_path = os.path.join(base_dir, f".{LATEST_SNAPSHOT_FILE}.tmp")
+    with open(latest_tmp_path, "w") as latest_file:
+        latest_file.write(version)
+    os.replace(latest_tmp_path, os.path.join(base_dir, LATEST_SNAPSHOT_FILE))
+
+    versions = sorted(
+        name
+        for name in os.listdir(base_dir)
+        if not name.startswith(".")
+        and os.path.isfile(os.path.join(base_dir, name, MANIFEST_FILE))
+    )
+    for old_version in versions[:-versions_to_keep]:
+        shutil.rmtree(os.path.join(base_dir, old_version), ignore_errors=True)
+
+
+def get_latest_version(base_dir: str) -> str:
+    with open(os.path.join(base_dir, LATEST_SNAPSHOT_FILE)) as latest_file:
+        return latest_file.read().strip()
+
+
+def export_snapshot(
+    snapshot_dir: str = SNAPSHOT_DIR, chunk_size: int = DB_READ_CHUNK_SIZE
+) -> Snapshot:
+    # Writes a new snapshot version of every table in SNAPSHOT_TABLES and loads it.
+    # It is written to a temporary directory first and only becomes the latest
+    # snapshot once complete, so loaders never see a partial one. All tables are read
+    # in one transaction, so they are the DB at a single point in time: every item's
+    # item_text and restaurant is in the snapshot. In WAL mode that doesn't block
+    # writers, they only can't checkpoint past it until the export is done
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    tmp_path = os.path.join(snapshot_dir, f".{version}.tmp")
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "version": version,
+        "tables": {},
+    }
+    with ReadOnlySession() as session, session.begin():
+        for table, (query, columns) in SNAPSHOT_TABLES.items():
+            manifest["tables"][table] = _export_table(
+                session, os.path.join(tmp_path, table), query, columns, chunk_size
+            )
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+
+    publish_version(snapshot_dir, tmp_path, version, SNAPSHOTS_TO_KEEP)
+    return load_snapshot(snapshot_dir, version)
+
+
+def load_snapshot(
+    snapshot_dir: str = SNAPSHOT_DIR, version: Optional[str] = None
+) -> Snapshot:
+    # Memory maps the columns of a snapshot, the latest one by default. Nothing is
+    # read from disk until a column is used
+    version = version or get_latest_version(snapshot_dir)
+    path = os.path.join(snapshot_dir, version)
+    with open(os.path.join(path, MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest["format_version"] != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(
+            f"Snapshot {version} has format version {manifest['format_version']}, "
+            f"expected {SNAPSHOT_FORMAT_VERSION}. Export a new one"
+        )
+
+    tables = {}
+    for table, table_manifest in manifest["tables"].items():
+        table_path = os.path.join(path, table)
+        tables[table] = {}
+        for name, column in table_manifest["columns"].items():
+            if column["kind"] == ColumnKind.STRING:
+                tables[table][name] = StringColumn(
+                    np.load(
+                        _get_column_path(table_path, name, "offsets"), mmap_mode="r"
+                    ),
+                    np.load(_get_column_path(table_path, name, "data"), mmap_mode="r"),
+                )
+                continue
+            values = np.load(
+                _get_column_path(table_path, name, "values"), mmap_mode="r"
+            )
+            if column["kind"] == ColumnKind.CATEGORICAL:
+                values = CategoricalColumn(values, column["categories"])
+            tables[table][name] = values
+    return Snapshot(version, path, tables)
@@ -1,4 +1,6 @@
 import os
+from typing import List, TypeVar
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
@@ -9,12 +11,117 @@ DEFAULT_SLEEP_SEC = 10
 TASK_TIMEOUT_SECONDS = 60
 REQUEST_GET_TIMEOUT_SECS = 60
 
+# Async fetch engine limits, a single worker can have this many requests in flight.
+# FETCH_PER_HOST_LIMIT is also the size of each host's keep-alive connection pool
+FETCH_MAX_CONCURRENCY = 200
+FETCH_PER_HOST_LIMIT = 50
+FETCH_KEEPALIVE_SECS = 60
+# Number of pages handed to a single fetch task
+FETCH_BATCH_SIZE = 200
+BATCH_TASK_TIMEOUT_SECONDS = 1800
+# Most search pages fetched at once while discovering recipe urls
+DISCOVERY_MAX_WINDOW_PAGES = 20
+
+# Entities crawled within this many hours are fresh and not scheduled again.
+# Menus and listings change daily, recipes hardly ever
+RESTAURANTS_CRAWL_TTL_HOURS = 24
+RECIPES_CRAWL_TTL_HOURS = 30 * 24
+# Pending work of each flow, kept until the flow runs to completion
+CRAWL_FRONTIER_DIR = "data/frontier"
+# Runs a page is attempted by before the frontier gives up on it, a page whose task
+# fails every time would otherwise keep the frontier from ever being cleared
+CRAWL_FRONTIER_MAX_ATTEMPTS = 3
+# Columnar snapshots of the DB for analytics and scoring, one directory per version
+SNAPSHOT_DIR = "data/snapshots"
+# Dishes compared against all recipes at once while scoring, bounds the similarity
+# matrix held in memory to this many rows
+SCORING_CHUNK_SIZE = 1000
+# Texts are preprocessed in batches of this size on a pool of processes, each with
+# its own cache of the lemmas of this many distinct words
+PREPROCESS_BATCH_SIZE = 5000
+PREPROCESS_PROCESSES = os.cpu_count() or 1
+LEMMA_CACHE_SIZE = 2**17
+# Closest recipes kept per dish, and threads the similarity blocks are spread over
+SIMILARITY_TOP_K = 5
+SIMILARITY_THREADS = os.cpu_count() or 1
+# Approximate similarity only compares a dish with the recipes its highest weighted
+# words weigh the most in, this many words per dish and recipes per word
+RECIPE_INDEX_QUERY_WORDS = 5
+RECIPE_INDEX_POSTINGS = 100
+# Vocabulary, IDF and recipe vectors of the last full scoring run, which incremental
+# runs score new and changed dishes with
+SCORING_MODEL_DIR = "data/scoring_model"
+# A full refit is recommended once the dishes scored incrementally since the last fit
+# reach this fraction of the dishes it was fit on, or this fraction of their words
+# is missing from its vocabulary
+REFIT_NEW_DISHES_FRACTION = 0.2
+REFIT_OOV_TOKENS_FRACTION = 0.1
+
+# (requests per second, burst size) allowed per host, shared by all workers
+HOST_RATE_LIMITS = {
+    "www.ubereats.com": (5.0, 10),
+    "www.allrecipes.com": (5.0, 10),
+    "cooking.nytimes.com": (2.0, 5),
+}
+DEFAULT_RATE_LIMIT = (2.0, 5)
+
+# Raw responses are cached on disk and revalidated with ETag/Last-Modified once stale
+HTTP_CACHE_ENABLED = os.environ.get("FOODREC_HTTP_CACHE", "1") == "1"
+# Serves every cached page regardless of age and never goes to the network,
+# useful for re-running parsers over previously crawled pages
+HTTP_CACHE_OFFLINE = os.environ.get("FOODREC_HTTP_CACHE_OFFLINE", "0") == "1"
+HTTP_CACHE_DIR = "data/http_cache"
+HTTP_CACHE_MAX_BYTES = 2 * 1024**3
+HTTP_CACHE_TTL_SECS = {
+    "www.ubereats.com": 24 * 3600,
+    "www.allrecipes.com": 7 * 24 * 3600,
+    "cooking.nytimes.com": 7 * 24 * 3600,
+}
+DEFAULT_HTTP_CACHE_TTL_SECS = 24 * 3600
+
+T = TypeVar("T")
+
 BASE_UE_URL = "https://www.ubereats.com"
 BASE_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36"
 }
 
 
+def chunked(values: List[T], chunk_size: int) -> List[List[T]]:
+    return [values[i : i + chunk_size] for i in range(0, len(values), chunk_size)]
+
+
+def normalize_url(url: str) -> str:
+    # Lowercases the scheme and host, drops default ports and fragments and sorts the query
+    parts = urlsplit(url.strip())
+    scheme, netloc = parts.scheme.lower(), parts.netloc.lower()
+    if (scheme, parts.port) in (("http", 80), ("https", 443)):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+# Query params that only track where a link was clicked, not what it points to
+TRACKING_QUERY_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref", "ref_src"}
+TRACKING_QUERY_PARAM_PREFIXES = ("utm_",)
+
+
+def canonicalize_url(url: str) -> str:
+    # The identity of a page across sources and runs: a normalized url without
+    # tracking params and trailing slashes, relative urls stay relative
+    parts = urlsplit(normalize_url(url))
+    query = urlencode(
+        [
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if key.lower() not in TRACKING_QUERY_PARAMS
+            and not key.lower().startswith(TRACKING_QUERY_PARAM_PREFIXES)
+        ]
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme, parts.netloc, path, query, ""))
+
+
 def parse_city(city: str) -> str:
     return f"{city.replace(' ', '-').lower()}-ca"
 